@@ -1,14 +1,22 @@
 import os
+import re
+import json
 import time
+import asyncio
 from threading import Timer
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 import google.generativeai as genai
-from elevenlabs.client import ElevenLabs
+from elevenlabs.client import ElevenLabs, AsyncElevenLabs
 import uuid
+import hashlib
 import datetime
+import threading
+from voice_vad import Endpointer, pcm_to_wav
+from safety import SafetyFilter
+from prompt_cache import PrefixCachedModel, PromptStats
 
 # ----------------- Configure APIs -----------------
 app = FastAPI()
@@ -70,9 +78,61 @@ Avoid present-tense action descriptions for the cat; instead, focus on what was
 Promote kindness, curiosity, and a love for learning, keeping each story fresh and engaging.
 """
 
+INTERACT_PROMPT = f"""
+Act as {PET_NAME}, the friendly, adventurous cat, and interact in a playful, engaging, and age-appropriate manner for kids.
+
+MUST FOLLOW:
+{GUIDELINES}
+"""
+
+VOICE_PROMPT = f"""
+Act as {PET_NAME}, the friendly, adventurous cat, and talk with the kid in a playful, engaging, and age-appropriate manner.
+This is a spoken conversation: answer in one to three short sentences, with no emojis or stage directions.
+
+MUST FOLLOW:
+{GUIDELINES}
+"""
+
+# The static prompts above go to Gemini once per model, as a cached context
+# when PROMPT_CACHE_MODEL (a versioned model) accepts one and as a system
+# instruction otherwise, so each request only carries its dynamic tail.
+# PROMPT_CACHE is "auto", "cached", "system", "inline" or "local" (offline stand-in)
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "auto")
+PROMPT_CACHE_MODEL = os.getenv("PROMPT_CACHE_MODEL", "models/gemini-1.5-flash-002")
+prompt_stats = PromptStats()
+
+def prefix_model(name, prefix):
+    return PrefixCachedModel(
+        "gemini-1.5-flash", prefix, name=name, mode=PROMPT_CACHE,
+        cache_model=PROMPT_CACHE_MODEL, stats=prompt_stats
+    )
+
+launch_model = prefix_model("launch", PROMPT_TEMPLATE)
+interact_model = prefix_model("interact", INTERACT_PROMPT)
+voice_model = prefix_model("voice", VOICE_PROMPT)
+
 last_request_time = 0  # To track the last API call time
 cooldown_seconds = 30  # Cooldown time in seconds
 
+# Voice WebSocket: 16-bit mono PCM in, streamed audio out
+VOICE_SAMPLE_RATE = 16000
+VOICE_SAMPLE_RATES = (8000, 16000, 24000, 48000)
+STREAM_MODEL_ID = os.getenv("STREAM_MODEL_ID", "eleven_turbo_v2_5")
+STREAM_OUTPUT_FORMAT = os.getenv("STREAM_OUTPUT_FORMAT", "mp3_44100_64")
+MAX_VOICE_SESSIONS = int(os.getenv("MAX_VOICE_SESSIONS", "200"))
+VOICE_HISTORY_TURNS = 6
+
+eleven_async = AsyncElevenLabs(api_key=ELEVEN_API)
+active_voice_sessions = 0
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# Local safety prefilter: unsafe kid messages get a pre-rendered redirect
+# without any Gemini or ElevenLabs call, and replies are checked before synthesis
+safety = SafetyFilter(os.getenv("SAFETY_BLOCKLIST"))
+REDIRECT_AUDIO_FORMAT = "mp3_44100_64"
+
+TRANSCRIBE_PROMPT = "Transcribe exactly what the child says in this audio. Reply with the words only."
+
 # ----------------- Helper Functions -----------------
 def schedule_audio_deletion(file_path, delay=60):
     """
@@ -85,9 +145,10 @@ def schedule_audio_deletion(file_path, delay=60):
 
     Timer(delay, delete_file).start()
 
-def generate_audio(api_key, text, output_format, model_id, output_filename="output.mp3"):
+def generate_audio(api_key, text, output_format, model_id, output_filename="output.mp3", delete_after=60):
     """
-    Generates audio from text using the ElevenLabs API and saves it to a file.
+    Generates audio from text using the ElevenLabs API and saves it to a file,
+    deleted again after `delete_after` seconds (None keeps it).
     If an error occurs, it logs the error and returns '404.mp3'.
     """
     try:
@@ -115,7 +176,8 @@ def generate_audio(api_key, text, output_format, model_id, output_filename="outp
             audio_file.write(audio_data)
 
         # Schedule deletion of the file after 60 seconds
-        schedule_audio_deletion(output_path, delay=60)
+        if delete_after is not None:
+            schedule_audio_deletion(output_path, delay=delete_after)
 
         print(f"Audio saved as {output_path}")
         return f"/static/{output_filename}"
@@ -123,6 +185,244 @@ def generate_audio(api_key, text, output_format, model_id, output_filename="outp
         print(f"Error generating audio: {str(e)}")
         return "/static/404.mp3"
 
+def voice_prompt(history):
+    """
+    Builds the dynamic part of a voice turn's prompt from the last few
+    exchanges; the instructions are VOICE_PROMPT, held by voice_model.
+    """
+    recent = "\n".join(
+        f"Kid: {turn['kid']}\n{PET_NAME}: {turn['pet']}" for turn in history[-VOICE_HISTORY_TURNS:]
+    )
+    return f"Conversation so far:\n{recent or '(none yet)'}\n"
+
+class VoiceSession:
+    """
+    One full-duplex voice conversation over a WebSocket.
+
+    The client streams 16-bit mono PCM as binary frames. The endpointer finds
+    the end of each utterance as the audio arrives. The utterance is
+    transcribed and the transcript goes through the safety prefilter like a
+    typed turn, so an unsafe one is redirected before any reply call. The
+    reply streams back sentence by sentence: each sentence is sent as a
+    "reply_text" message followed by its ElevenLabs audio as binary frames,
+    while Gemini is still writing the next one. When the kid starts talking
+    again (or sends "interrupt"), the reply in flight is cancelled.
+
+    Control messages from the client (JSON text frames):
+        {"type": "start", "sample_rate": 16000, "output_format": "mp3_44100_64"}
+        {"type": "text", "text": "..."}     a typed or browser-transcribed turn
+        {"type": "end_of_speech"}           push-to-talk release
+        {"type": "interrupt"}
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.sample_rate = VOICE_SAMPLE_RATE
+        self.output_format = STREAM_OUTPUT_FORMAT
+        self.endpointer = Endpointer(self.sample_rate)
+        self.history = []
+        self.reply_task = None
+        self.send_lock = asyncio.Lock()
+
+    async def run(self):
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    await self.on_audio(message["bytes"])
+                elif message.get("text") is not None:
+                    try:
+                        control = json.loads(message["text"])
+                    except json.JSONDecodeError:
+                        await self.send({"type": "error", "message": "control messages must be JSON"})
+                        continue
+                    if isinstance(control, dict):
+                        await self.on_control(control)
+                    else:
+                        await self.send({"type": "error", "message": "control messages must be JSON objects"})
+        finally:
+            if self.reply_task:
+                self.reply_task.cancel()
+
+    async def on_audio(self, pcm):
+        for event, utterance in self.endpointer.process(pcm):
+            if event == "start":
+                # Barge-in: the kid talks over the pet
+                await self.interrupt()
+                await self.send({"type": "speech_start"})
+            else:
+                await self.send({"type": "speech_end"})
+                self.start_reply(audio=utterance)
+
+    async def on_control(self, message):
+        kind = message.get("type")
+        if kind == "start":
+            try:
+                sample_rate = int(message.get("sample_rate", VOICE_SAMPLE_RATE))
+            except (TypeError, ValueError):
+                sample_rate = None
+            if sample_rate not in VOICE_SAMPLE_RATES:
+                await self.send({
+                    "type": "error",
+                    "message": f"sample_rate must be one of {', '.join(map(str, VOICE_SAMPLE_RATES))}"
+                })
+                return
+            self.sample_rate = sample_rate
+            self.output_format = message.get("output_format", STREAM_OUTPUT_FORMAT)
+            self.endpointer = Endpointer(self.sample_rate)
+            await self.send({"type": "listening"})
+        elif kind == "text" and message.get("text", "").strip():
+            await self.interrupt()
+            verdict = safety.check(message["text"])
+            if verdict.safe:
+                self.start_reply(text=message["text"].strip())
+            else:
+                self.reply_task = asyncio.create_task(self.redirect(verdict.category))
+        elif kind == "end_of_speech":
+            utterance = self.endpointer.flush()
+            if utterance:
+                await self.send({"type": "speech_end"})
+                self.start_reply(audio=utterance)
+        elif kind == "interrupt":
+            await self.interrupt()
+
+    async def interrupt(self):
+        if self.reply_task and not self.reply_task.done():
+            self.reply_task.cancel()
+            try:
+                await self.reply_task
+            except asyncio.CancelledError:
+                pass
+            await self.send({"type": "interrupted"})
+
+    def start_reply(self, text=None, audio=None):
+        self.reply_task = asyncio.create_task(self.reply(text, audio))
+
+    async def reply(self, text=None, audio=None):
+        if audio is not None:
+            text = await self.transcribe({"mime_type": "audio/wav", "data": pcm_to_wav(audio, self.sample_rate)})
+            if not text:
+                await self.send({"type": "error", "message": "didn't catch that"})
+                return
+            verdict = safety.check(text)
+            if not verdict.safe:
+                await self.redirect(verdict.category)
+                return
+
+        sentences = asyncio.Queue()
+        contents = [voice_prompt(self.history) + f"\nThe kid says: '{text}'"]
+        writer = asyncio.create_task(self.write_reply(contents, sentences))
+        try:
+            spoken = []
+            while (sentence := await sentences.get()) is not None:
+                if not safety.check(sentence, stage="output").safe:
+                    # Drop the rest of the reply and redirect instead
+                    writer.cancel()
+                    await self.redirect()
+                    return
+                spoken.append(sentence)
+                await self.speak(sentence)
+            await writer
+            await self.send({"type": "reply_end"})
+            self.history.append({"kid": text, "pet": " ".join(spoken)})
+        except Exception as e:
+            print(f"Voice reply error: {str(e)}")
+            await self.send({"type": "error", "message": str(e)})
+        finally:
+            writer.cancel()
+
+    async def write_reply(self, contents, sentences):
+        """
+        Streams the Gemini reply into `sentences`, one complete sentence at a
+        time; None marks the end.
+        """
+        pending = ""
+        try:
+            response = await voice_model.generate_content_async(contents, stream=True)
+            async for chunk in response:
+                pending += chunk.text
+                *complete, pending = SENTENCE_END.split(pending)
+                for sentence in complete:
+                    await sentences.put(sentence.strip())
+            if pending.strip():
+                await sentences.put(pending.strip())
+        finally:
+            await sentences.put(None)
+
+    async def transcribe(self, clip):
+        try:
+            response = await model.generate_content_async([TRANSCRIBE_PROMPT, clip])
+            heard = response.text.strip()
+        except Exception as e:
+            print(f"Transcription error: {str(e)}")
+            return None
+        await self.send({"type": "transcript", "text": heard})
+        return heard
+
+    async def speak(self, sentence):
+        await self.send({"type": "reply_text", "text": sentence})
+        try:
+            async for chunk in eleven_async.text_to_speech.convert_as_stream(
+                voice_id=VOICE_ID,
+                text=sentence,
+                model_id=STREAM_MODEL_ID,
+                output_format=self.output_format,
+            ):
+                async with self.send_lock:
+                    await self.websocket.send_bytes(chunk)
+        except Exception as e:
+            # Keep the conversation going as text if audio fails
+            print(f"Error streaming audio: {str(e)}")
+            await self.send({"type": "error", "message": "audio unavailable"})
+
+    async def redirect(self, category=None):
+        """
+        Sends a safety redirect with no upstream calls: its pre-rendered audio
+        when there is one in the client's format, otherwise the text alone.
+        """
+        text = safety.redirect(category)
+        await self.send({"type": "reply_text", "text": text})
+        path = os.path.join("static", redirect_filename(text))
+        if self.output_format == REDIRECT_AUDIO_FORMAT and os.path.exists(path):
+            with open(path, "rb") as f:
+                audio = f.read()
+            async with self.send_lock:
+                await self.websocket.send_bytes(audio)
+        await self.send({"type": "reply_end", "redirected": True})
+
+    async def send(self, message):
+        async with self.send_lock:
+            await self.websocket.send_text(json.dumps(message))
+
+def redirect_filename(text):
+    return f"safety_{hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]}.mp3"
+
+def redirect_audio_url(text):
+    """
+    URL of the pre-rendered audio for a redirect line, or None when it hasn't
+    been rendered; redirects never wait on ElevenLabs.
+    """
+    filename = redirect_filename(text)
+    if os.path.exists(os.path.join("static", filename)):
+        return f"/static/{filename}"
+    return None
+
+def prerender_redirects():
+    for text in safety.redirect_phrases():
+        filename = redirect_filename(text)
+        if not os.path.exists(os.path.join("static", filename)):
+            generate_audio(ELEVEN_API, text, REDIRECT_AUDIO_FORMAT, "eleven_multilingual_v2", filename, delete_after=None)
+
+@app.on_event("startup")
+def start_prerender_redirects():
+    threading.Thread(target=prerender_redirects, daemon=True).start()
+
+def redirect_response(category=None):
+    text = safety.redirect(category)
+    return {"result": text, "audio_url": redirect_audio_url(text), "redirected": True}
+
 # ----------------- FastAPI Endpoints -----------------
 class PromptRequest(BaseModel):
     topic: str = "general"
@@ -135,14 +435,25 @@ def homepage(request: Request):
         
         {"name": "Interact with kid", "path": "/interact", "description": "Interacts with the kid based on the provided topic.",
          "method": "GET", "params": [], "syntax": "/interact"},
+
+        {"name": "Safety stats", "path": "/safety/stats", "description": "Safety prefilter decisions and latency percentiles per stage.",
+         "method": "GET", "params": [], "syntax": "/safety/stats"},
+
+        {"name": "Prompt stats", "path": "/prompt/stats", "description": "Per-endpoint Gemini prompt bytes and tokens, as sent and with the static prompt inlined.",
+         "method": "GET", "params": [], "syntax": "/prompt/stats"},
+
+        {"name": "Voice conversation", "path": "/voice", "description": "WebSocket: stream 16 kHz 16-bit mono PCM in, receive the reply as streamed audio frames and JSON events. Talking over the pet interrupts it.",
+         "method": "WS", "params": [], "syntax": "/voice"},
     ]
     return templates.TemplateResponse("homepage.html", {"request": request, "endpoints": endpoints})
 
 @app.get("/launch")
 def app_launch():
     try:
-        response = model.generate_content(PROMPT_TEMPLATE)
+        response = launch_model.generate_content("Tell today's story.")
         text = response.text.strip()
+        if not safety.check(text, stage="output").safe:
+            return {"message": "App launched successfully!", **redirect_response()}
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"speech_{timestamp}_{uuid.uuid4().hex}.mp3"
         audio_url = generate_audio(ELEVEN_API, text, "mp3_44100_64", "eleven_multilingual_v2", filename)
@@ -154,6 +465,11 @@ def app_launch():
 def interact(request: PromptRequest):
     global last_request_time
 
+    # Unsafe messages never reach Gemini or ElevenLabs, and don't use up the cooldown
+    verdict = safety.check(request.topic)
+    if not verdict.safe:
+        return redirect_response(verdict.category)
+
     # Check cooldown
     current_time = time.time()
     time_since_last_request = current_time - last_request_time
@@ -165,20 +481,39 @@ def interact(request: PromptRequest):
     last_request_time = current_time
 
     try:
-        user_prompt = f"""
-        Act as {PET_NAME}, the friendly, adventurous cat, and interact in a playful, engaging, and age-appropriate manner for kids.
-        The kid says:
-        '{request.topic}'
-
-        MUST FOLLOW:
-        {GUIDELINES}
-        """
-        response = model.generate_content(user_prompt)
+        response = interact_model.generate_content(f"The kid says:\n'{request.topic}'")
         text = response.text.strip()
         print(text)
+        if not safety.check(text, stage="output").safe:
+            return redirect_response()
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"speech_{timestamp}_{uuid.uuid4().hex}.mp3"
         audio_url = generate_audio(ELEVEN_API, text, "mp3_44100_64", "eleven_multilingual_v2", filename)
         return {"result": text, "audio_url": audio_url}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.get("/safety/stats")
+def safety_stats():
+    return safety.stats()
+
+@app.get("/prompt/stats")
+def prompt_cache_stats():
+    return prompt_stats.summary()
+
+@app.websocket("/voice")
+async def voice(websocket: WebSocket):
+    global active_voice_sessions
+
+    if active_voice_sessions >= MAX_VOICE_SESSIONS:
+        await websocket.close(code=1013)  # Try again later
+        return
+
+    await websocket.accept()
+    active_voice_sessions += 1
+    try:
+        await VoiceSession(websocket).run()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        active_voice_sessions -= 1
@@ -0,0 +1,205 @@
+"""
+Local safety prefilter for kid inputs and LLM replies.
+
+Runs in front of the LLM and again on its reply before synthesis, so unsafe
+turns get a pre-rendered redirect with no Gemini or TTS call. The check is
+compiled blocklists: one case-insensitive regex per category over normalized
+text (leetspeak folded, s.p.a.c.e.d letters joined), plus personal-information
+patterns on the raw text. Phrasings the lists miss are left to Gemini's own
+safety filtering.
+
+Check a line by hand with `python safety.py check "some text"`.
+
+interactive_application/safety.py and api/safety.py are identical
+copies, since the two trees are deployed separately; change both together.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque, namedtuple
+
+Verdict = namedtuple("Verdict", ["safe", "category", "score", "ms"])
+
+# Every term is a whole word or phrase and also matches its plural. A term
+# ending in "*" matches any word starting with it; the built-in lists spell
+# out word forms instead, since prefixes catch innocent words ("shit*" would
+# block "shitake", "retard*" "fire retardant"). "*" is still allowed in an
+# extra blocklist.
+BLOCKLISTS = {
+    "sexual": [
+        "porn", "porno", "pornography", "pornographic", "sex", "sexy", "sexual", "sexually", "nude",
+        "nudity", "naked", "boobs", "penis", "vagina", "xxx", "horny", "masturbate", "masturbating",
+        "masturbation", "hentai", "nsfw", "onlyfans", "stripper", "blowjob"
+    ],
+    "self_harm": [
+        "suicide", "suicidal", "kill myself", "killing myself", "self harm", "want to die", "end my life",
+        # Only with intent: "I hurt myself at football" is a scraped knee
+        "want to hurt myself", "going to hurt myself", "gonna hurt myself", "want to cut myself",
+        "going to cut myself", "gonna cut myself"
+    ],
+    "violence": [
+        "murder", "murdered", "murdering", "murderer", "behead", "beheaded", "beheading", "massacre",
+        "how to kill", "make a bomb", "shoot someone", "stab someone"
+    ],
+    "drugs": [
+        "cocaine", "heroin", "meth", "smoke weed", "smoking weed", "marijuana", "vape", "vaping", "get high",
+        "getting high", "lsd", "crack pipe"
+    ],
+    "profanity": [
+        "fuck", "fucks", "fucked", "fucking", "fuckin", "fucker", "motherfucker", "shit", "shitty",
+        "shitting", "bullshit", "bitch", "bitchy", "bastard", "asshole", "cunt", "slut", "whore", "retard",
+        "retarded", "dickhead"
+    ]
+}
+
+# Innocent phrases that contain a blocked term
+ALLOWLIST = ["naked mole rat", "sex of the", "essex", "sussex", "middlesex"]
+
+PERSONAL_INFO = [
+    r"\b\d{3}[\s.-]?\d{3}[\s.-]?\d{4}\b",  # phone number
+    r"\b[\w.+-]+@[\w-]+\.[\w.]+\b",  # email address
+    r"\bmy (?:home )?address is\b",
+    r"\bi live (?:at|on) \d+",
+    r"\bmy password is\b"
+]
+
+REDIRECTS = {
+    "self_harm": [
+        "That sounds really big and important. Please tell a grown-up you trust, like a parent or teacher, "
+        "how you're feeling. They care about you and want to help!"
+    ],
+    "personal_info": [
+        "Ooh, let's keep things like addresses, phone numbers and passwords private, okay? "
+        "Tell me about your favourite animal instead!"
+    ],
+    None: [
+        "Hmm, that's a question for a grown-up you trust. How about we talk about something fun, "
+        "like the biggest animal in the ocean?",
+        "Let's pick a different adventure! Do you want to hear a fun fact about space?",
+        "That's not something I can talk about, but I know lots about dinosaurs! Want to hear one?"
+    ]
+}
+
+_LEET = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"})
+_SPACED = re.compile(r"\b(?:[a-z][\s.\-_*]+){2,}[a-z]\b")
+_SEPARATORS = re.compile(r"[\s.\-_*]+")
+
+
+def normalize(text):
+    """
+    Lowercases, folds leetspeak, and joins letters spelled out one by one
+    ("p.o.r.n", "s e x") so the blocklists see the word.
+    """
+    text = (text or "").lower().translate(_LEET)
+    return _SPACED.sub(lambda m: _SEPARATORS.sub("", m.group()), text)
+
+
+def term_pattern(term):
+    words = r"\s+".join(re.escape(word) for word in term.rstrip("*").split())
+    if term.endswith("*"):
+        return words + r"\w*"
+    return words + r"(?:s|es)?"
+
+
+def compile_blocklists(blocklists):
+    alternatives = [
+        f"(?P<{category}>" + "|".join(term_pattern(term) for term in terms) + ")"
+        for category, terms in blocklists.items() if terms
+    ]
+    return re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)")
+
+
+class SafetyFilter:
+    """
+    Classifies text as safe or unsafe and keeps per-stage decision counts
+    and latency percentiles.
+
+    `extra_blocklist` is an optional JSON file of {category: [terms]} merged
+    into the built-in lists.
+    """
+
+    def __init__(self, extra_blocklist=None, window=2000):
+        blocklists = {category: list(terms) for category, terms in BLOCKLISTS.items()}
+        if extra_blocklist and os.path.exists(extra_blocklist):
+            with open(extra_blocklist) as f:
+                for category, terms in json.load(f).items():
+                    blocklists.setdefault(category, []).extend(terms)
+
+        self.blocklist = compile_blocklists(blocklists)
+        self.allowlist = re.compile("|".join(term_pattern(term) for term in ALLOWLIST))
+        self.personal_info = re.compile("|".join(PERSONAL_INFO), re.IGNORECASE)
+
+        self.lock = threading.Lock()
+        self.decisions = Counter()
+        self.latencies = {}
+        self.window = window
+
+    def check(self, text, stage="input"):
+        """
+        Returns a Verdict. `stage` ("input" or "output") only labels the
+        metrics, except that personal information is only looked for in input.
+        """
+        start = time.perf_counter()
+        category, score = self._classify(text or "", stage)
+        ms = (time.perf_counter() - start) * 1000
+
+        with self.lock:
+            self.decisions[(stage, category or "safe")] += 1
+            self.latencies.setdefault(stage, deque(maxlen=self.window)).append(ms)
+        return Verdict(category is None, category, score, ms)
+
+    def redirect(self, category=None):
+        return random.choice(REDIRECTS.get(category) or REDIRECTS[None])
+
+    @staticmethod
+    def redirect_phrases():
+        """
+        Every redirect line, for pre-rendering.
+        """
+        return [line for lines in REDIRECTS.values() for line in lines]
+
+    def stats(self):
+        with self.lock:
+            stats = {}
+            for stage, latencies in self.latencies.items():
+                ordered = sorted(latencies)
+                stats[stage] = {
+                    "decisions": {c: n for (s, c), n in self.decisions.items() if s == stage},
+                    "p50_ms": round(ordered[len(ordered) // 2], 4),
+                    "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 4),
+                    "max_ms": round(ordered[-1], 4)
+                }
+            return stats
+
+    def _classify(self, text, stage):
+        if stage == "input" and self.personal_info.search(text):
+            return "personal_info", 1.0
+
+        normalized = normalize(text)
+        if self.allowlist.search(normalized):
+            normalized = self.allowlist.sub(" ", normalized)
+        match = self.blocklist.search(normalized)
+        if match:
+            return match.lastgroup, 1.0
+        return None, 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a line of text with the safety prefilter")
+    parser.add_argument("command", choices=["check"])
+    parser.add_argument("text")
+    parser.add_argument("--stage", default="input", choices=["input", "output"])
+    args = parser.parse_args()
+
+    verdict = SafetyFilter().check(args.text, args.stage)
+    print(json.dumps(verdict._asdict()))
+    sys.exit(0 if verdict.safe else 1)
+
+
+if __name__ == "__main__":
+    main()
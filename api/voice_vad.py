@@ -0,0 +1,108 @@
+import io
+import wave
+
+import numpy as np
+
+
+def pcm_to_wav(pcm, sample_rate=16000):
+    """
+    Wraps raw 16-bit mono PCM in a WAV container.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class Endpointer:
+    """
+    Incremental utterance detection over streamed 16-bit mono PCM.
+
+    Frame energies are computed for each incoming block at once. A frame is
+    voiced when it is `margin_db` above a noise floor that drops to quieter
+    frames immediately and rises slowly otherwise, more slowly still during
+    voiced frames. An utterance starts after
+    `min_speech_ms` of voiced audio (reported right away, which is what
+    barge-in listens for) and ends after `hangover_ms` of silence.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=20, margin_db=10, hangover_ms=400,
+                 min_speech_ms=120, preroll_ms=200, max_utterance_seconds=15, noise_adapt=0.05):
+        self.sample_rate = sample_rate
+        self.frame_bytes = int(sample_rate * frame_ms / 1000) * 2
+        self.margin_db = margin_db
+        self.hangover_frames = max(1, int(hangover_ms / frame_ms))
+        self.min_speech_frames = max(1, int(min_speech_ms / frame_ms))
+        self.preroll_frames = int(preroll_ms / frame_ms)
+        self.max_frames = int(max_utterance_seconds * 1000 / frame_ms)
+        self.noise_adapt = noise_adapt
+
+        self.noise_floor = None
+        self.in_speech = False
+        self._remainder = b""
+        self._frames = []
+        self._voiced_run = 0
+        self._silent_run = 0
+
+    def process(self, pcm):
+        """
+        Feeds a block of PCM bytes. Returns a list of events: ("start", None)
+        when speech begins and ("end", utterance_pcm) when it ends.
+        """
+        data = self._remainder + pcm
+        n_frames = len(data) // self.frame_bytes
+        self._remainder = data[n_frames * self.frame_bytes:]
+        if n_frames == 0:
+            return []
+
+        samples = np.frombuffer(data[:n_frames * self.frame_bytes], dtype="<i2").reshape(n_frames, -1)
+        rms = np.sqrt(np.mean(np.square(samples.astype(np.float32) / 32768.0), axis=1))
+        energy = 20 * np.log10(np.maximum(rms, 1e-6))
+        if self.noise_floor is None:
+            self.noise_floor = float(energy.min())
+
+        events = []
+        for i in range(n_frames):
+            voiced = energy[i] - self.noise_floor > self.margin_db
+            # A twentieth of the usual rate while voiced: a TV switched on mid
+            # utterance still ends it eventually
+            if energy[i] < self.noise_floor:
+                self.noise_floor = float(energy[i])
+            else:
+                rate = self.noise_adapt if not voiced else self.noise_adapt / 20
+                self.noise_floor += rate * (float(energy[i]) - self.noise_floor)
+
+            event = self._step(data[i * self.frame_bytes:(i + 1) * self.frame_bytes], voiced)
+            if event:
+                events.append(event)
+        return events
+
+    def flush(self):
+        utterance = b"".join(self._frames) if self.in_speech else None
+        self._reset()
+        return utterance
+
+    def _step(self, frame, voiced):
+        self._frames.append(frame)
+        if not self.in_speech:
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.min_speech_frames:
+                self.in_speech = True
+                self._silent_run = 0
+                return ("start", None)
+            self._frames = self._frames[-(self.preroll_frames + self.min_speech_frames):]
+            return None
+
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run >= self.hangover_frames or len(self._frames) >= self.max_frames:
+            return ("end", self.flush())
+        return None
+
+    def _reset(self):
+        self.in_speech = False
+        self._frames = []
+        self._voiced_run = 0
+        self._silent_run = 0
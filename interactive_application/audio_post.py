@@ -0,0 +1,76 @@
+import numpy as np
+import soundfile as sf
+
+from audio_utils import resample, to_float
+from vad import frame_energy_db
+
+
+def trim_silence(samples, sample_rate, frame_ms=10, threshold_db=40, pad_ms=60):
+    """
+    Cuts leading and trailing silence. A frame is silent when it is more than
+    `threshold_db` below the loudest frame; `pad_ms` is kept on both sides so
+    the first and last syllables aren't clipped. Returns a view, not a copy.
+    """
+    frame_len = max(1, int(sample_rate * frame_ms / 1000))
+    energy = frame_energy_db(samples, frame_len)
+    if energy.size == 0:
+        return samples
+
+    loud = np.flatnonzero(energy > energy.max() - threshold_db)
+    pad = int(sample_rate * pad_ms / 1000)
+    start = max(0, loud[0] * frame_len - pad)
+    end = min(len(samples), (loud[-1] + 1) * frame_len + pad)
+    return samples[start:end]
+
+
+def normalize_loudness(samples, sample_rate, target_db=-20, peak=0.95, frame_ms=30, gate_db=30):
+    """
+    Scales `samples` in place so speech sits at `target_db` RMS (dBFS).
+
+    Loudness is measured over frames within `gate_db` of the loudest one, so
+    pauses between words don't pull the estimate down. The gain is capped so
+    the peak stays under `peak`.
+    """
+    frame_len = max(1, int(sample_rate * frame_ms / 1000))
+    energy = frame_energy_db(samples, frame_len)
+    if energy.size == 0:
+        return samples
+
+    voiced = energy[energy > energy.max() - gate_db]
+    loudness = 10 * np.log10(np.mean(np.power(10, voiced / 10)))
+    gain = 10 ** ((target_db - loudness) / 20)
+    max_abs = np.max(np.abs(samples))
+    if max_abs > 0:
+        gain = min(gain, peak / max_abs)
+    samples *= gain
+    return samples
+
+
+def postprocess(samples, sample_rate, target_rate=None, target_db=-20):
+    """
+    Trims silence, normalizes loudness and optionally resamples down.
+    Returns (float32 samples, sample_rate).
+    """
+    samples = np.array(to_float(samples), dtype=np.float32)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    samples = trim_silence(samples, sample_rate)
+    normalize_loudness(samples, sample_rate, target_db=target_db)
+    if target_rate and target_rate < sample_rate:
+        samples = resample(samples, sample_rate, target_rate).astype(np.float32)
+        sample_rate = target_rate
+    return samples, sample_rate
+
+
+def postprocess_file(path, target_rate=None, target_db=-20):
+    """
+    Post-processes a WAV file in place as 16-bit PCM. Returns `path`; on any
+    error the file is left untouched.
+    """
+    try:
+        samples, sample_rate = sf.read(path, dtype="float32")
+        samples, sample_rate = postprocess(samples, sample_rate, target_rate, target_db)
+        sf.write(path, samples, sample_rate, subtype="PCM_16")
+    except Exception as e:
+        print(f"Audio post-processing error for {path}: {e}")
+    return path
@@ -0,0 +1,29 @@
+import math
+
+import numpy as np
+from scipy.signal import resample_poly
+
+
+def resample(audio, from_rate, to_rate):
+    """
+    Polyphase resampling; its low-pass filter keeps downsampling (e.g. Bark's
+    24 kHz output to 16 kHz) from folding high frequencies back as aliasing.
+    """
+    if from_rate == to_rate or len(audio) == 0:
+        return audio
+    divisor = math.gcd(int(from_rate), int(to_rate))
+    return resample_poly(audio, int(to_rate) // divisor, int(from_rate) // divisor)
+
+
+def to_float(audio):
+    audio = np.asarray(audio)
+    if audio.dtype == np.int16:
+        return audio.astype(np.float32) / 32767
+    return audio.astype(np.float32, copy=False)
+
+
+def to_int16(audio):
+    audio = np.asarray(audio)
+    if audio.dtype == np.int16:
+        return audio
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
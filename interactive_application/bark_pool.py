@@ -0,0 +1,154 @@
+import contextlib
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import Future, TimeoutError
+
+
+class PoolBusy(Exception):
+    pass
+
+
+def _bark_worker(worker_id, inbox, outbox, torch_threads):
+    # Pin the thread count before torch spins up its pools, so N workers
+    # share the cores instead of oversubscribing them
+    os.environ["OMP_NUM_THREADS"] = str(torch_threads)
+    import torch
+    torch.set_num_threads(torch_threads)
+    from bark import generate_audio, preload_models
+
+    preload_models()
+    outbox.put((None, worker_id, "ready"))
+
+    while True:
+        job = inbox.get()
+        if job is None:
+            break
+        job_id, text, voice_preset = job
+        try:
+            with torch.inference_mode():
+                audio = generate_audio(text, history_prompt=voice_preset)
+            outbox.put((job_id, worker_id, audio))
+        except Exception as e:
+            outbox.put((job_id, worker_id, e))
+
+
+@contextlib.contextmanager
+def _as_main_module():
+    """
+    Spawned children re-import the parent's __main__ (e.g. buddy.py, with all
+    its module-level setup) before running their target. While workers start,
+    __main__ points at this module instead, which has no side effects.
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class BarkPool:
+    """
+    A pool of Bark worker processes, each with its models loaded once and a
+    pinned torch thread count, so concurrent sessions synthesize in parallel
+    instead of queueing behind the GIL in the request thread.
+
+    Jobs go to the worker with the fewest jobs in flight. Once `max_queue`
+    jobs are in flight, submit() raises PoolBusy so the caller can fall back
+    to a cheaper engine right away instead of waiting. A worker that dies is
+    replaced the next time a caller times out waiting on it, and its pending
+    jobs fail.
+    """
+
+    def __init__(self, workers=2, torch_threads=None, max_queue=None):
+        self.ctx = mp.get_context("spawn")
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // workers)
+        self.max_queue = max_queue or workers * 2
+        self.inboxes = [None] * workers
+        self.outboxes = [None] * workers
+        self.processes = [None] * workers
+        self.in_flight = [0] * workers
+        self.futures = {}
+        self.job_ids = itertools.count()
+        self.lock = threading.Lock()
+        for worker_id in range(workers):
+            self._start(worker_id)
+
+    def _start(self, worker_id):
+        # Each worker gets its own queues: one that dies mid-write can leave
+        # a queue's lock held, so its replacement must not share them
+        inbox, outbox = self.ctx.Queue(), self.ctx.Queue()
+        self.inboxes[worker_id], self.outboxes[worker_id] = inbox, outbox
+        self.processes[worker_id] = self.ctx.Process(
+            target=_bark_worker, args=(worker_id, inbox, outbox, self.torch_threads), daemon=True
+        )
+        with _as_main_module():
+            self.processes[worker_id].start()
+        threading.Thread(
+            target=self._collect, args=(worker_id, outbox), name=f"bark-pool-results-{worker_id}", daemon=True
+        ).start()
+
+    def submit(self, text, voice_preset=None):
+        future = Future()
+        with self.lock:
+            if sum(self.in_flight) >= self.max_queue:
+                raise PoolBusy(f"Bark pool is full ({self.max_queue} jobs in flight)")
+            worker_id = min(range(len(self.in_flight)), key=self.in_flight.__getitem__)
+            job_id = next(self.job_ids)
+            self.in_flight[worker_id] += 1
+            self.futures[job_id] = (future, worker_id)
+            inbox = self.inboxes[worker_id]
+        inbox.put((job_id, text, voice_preset))
+        return future
+
+    def generate(self, text, voice_preset=None, timeout=None):
+        future = self.submit(text, voice_preset)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            self._replace_dead_workers()
+            raise
+
+    def _replace_dead_workers(self):
+        with self.lock:
+            for worker_id, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                print(f"Bark worker {worker_id} died (exit code {process.exitcode}), restarting it")
+                for job_id, (future, owner) in list(self.futures.items()):
+                    if owner == worker_id:
+                        del self.futures[job_id]
+                        future.set_exception(RuntimeError(f"Bark worker {worker_id} died"))
+                self.in_flight[worker_id] = 0
+                self._start(worker_id)
+
+    def close(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+
+    def _collect(self, worker_id, outbox):
+        # Runs until the worker is replaced
+        while self.outboxes[worker_id] is outbox:
+            try:
+                job_id, worker_id, result = outbox.get(timeout=1)
+            except queue.Empty:
+                continue
+            if job_id is None:
+                print(f"Bark worker {worker_id} ready")
+                continue
+            with self.lock:
+                entry = self.futures.pop(job_id, None)
+                if entry is None:
+                    continue
+                self.in_flight[worker_id] -= 1
+            future = entry[0]
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -5,23 +5,28 @@ import speech_recognition as sr
 import pyttsx3
 import os
 from pathlib import Path
-import json
-from datetime import datetime
 from dotenv import load_dotenv
 import torch
 from TTS.api import TTS
 import numpy as np
-from scipy.io import wavfile
 import tempfile
-<<<<<<< HEAD
+from concurrent.futures import ThreadPoolExecutor
 from bark import generate_audio, preload_models, SAMPLE_RATE
-from bark import preload_models
 import soundfile as sf
 import random
-=======
-from bark import SAMPLE_RATE, generate_audio, preload_models
-from scipy.io.wavfile import write as write_wav
->>>>>>> 1d186285b6ffdbe627e9c3120eaba79bd0ce670b
+from history_store import ChatHistoryStore
+from keyword_matcher import buddy_matcher
+from model_client import ModelClient
+from bark_pool import BarkPool
+from glow_accel import GlowAccelerator
+from phrase_bank import PhraseBank, PhraseTemplate
+from audio_post import postprocess, postprocess_file
+from session_cache import SessionCache
+from conversation import ConversationManager
+from sentences import split_sentences
+from tracing import Tracer, user_key
+from safety import SafetyFilter
+from prompt_cache import PrefixCachedModel
 
 # Load the .env file
 load_dotenv()
@@ -29,17 +34,53 @@ load_dotenv()
 # Configuration
 gemini_key = os.getenv('GEMINI_API_KEY')
 genai.configure(api_key=gemini_key)
-model = genai.GenerativeModel('gemini-pro')
+# gemini-pro takes no system instruction, so the prompt cache's "system" mode
+# needs a 1.5 model or newer
+GEMINI_MODEL = os.getenv("BUDDY_GEMINI_MODEL", "gemini-1.5-flash")
+model = genai.GenerativeModel(GEMINI_MODEL)
 
 # Initialize speech recognition
 recognizer = sr.Recognizer()
 
-# Initialize Coqui TTS with Glow-TTS model
+# When a shared model server is running, use it instead of loading our own
+# copies of Bark, Glow-TTS and Whisper
+MODEL_SERVER_URL = os.getenv("DIGIMATE_MODEL_SERVER")
+model_client = ModelClient(MODEL_SERVER_URL) if MODEL_SERVER_URL else None
+
+# Bark can run in a pool of worker processes so concurrent sessions
+# synthesize in parallel; 0 keeps it in-process
+BARK_WORKERS = int(os.getenv("BUDDY_BARK_WORKERS", "0"))
+BARK_MAX_QUEUE = int(os.getenv("BUDDY_BARK_MAX_QUEUE", "0")) or None
+# A pooled job that takes longer than this falls back to Glow-TTS
+BARK_TIMEOUT = float(os.getenv("BUDDY_BARK_TIMEOUT", "90"))
+bark_pool = None
+
+# The Glow-TTS fallback can run an exported vocoder ("onnx" or "torchscript")
+# with its own thread count and optional int8 weights; "eager" keeps PyTorch
+GLOW_BACKEND = os.getenv("BUDDY_GLOW_BACKEND", "eager")
+# With the torchscript backend this is torch.set_num_threads, which applies to
+# the whole process (Bark and Whisper included), not just Glow-TTS
+GLOW_THREADS = int(os.getenv("BUDDY_GLOW_THREADS", "0"))
+GLOW_QUANTIZE = os.getenv("BUDDY_GLOW_QUANTIZE", "0") == "1"
+
 device = "cuda" if torch.cuda.is_available() else "cpu"
-tts = TTS("tts_models/en/ljspeech/glow-tts").to(device)
+if model_client is None:
+    # Initialize Coqui TTS with Glow-TTS model
+    tts = TTS("tts_models/en/ljspeech/glow-tts").to(device)
+    if GLOW_BACKEND != "eager" and device == "cpu":
+        GlowAccelerator(tts, GLOW_BACKEND, threads=GLOW_THREADS, quantize=GLOW_QUANTIZE).install()
+
+    if BARK_WORKERS > 0:
+        bark_pool = BarkPool(workers=BARK_WORKERS, max_queue=BARK_MAX_QUEUE)
+    else:
+        # Preload Bark models
+        preload_models()
+
 
-# Preload Bark models
-preload_models()
+def bark_generate(text, voice_preset):
+    if bark_pool is not None:
+        return bark_pool.generate(text, voice_preset, timeout=BARK_TIMEOUT)
+    return generate_audio(text, history_prompt=voice_preset)
 
 # Directory setup
 responses_dir = Path("responses")
@@ -47,14 +88,56 @@ responses_dir.mkdir(exist_ok=True)
 
 chat_history_dir = Path("chat_history")
 chat_history_dir.mkdir(exist_ok=True)
+history_store = ChatHistoryStore(chat_history_dir)
+
+# Number of recent messages loaded when a returning child starts a new session
+HISTORY_TAIL = int(os.getenv("BUDDY_HISTORY_TAIL", "20"))
+
+# Active conversations stay in memory; turns are written to disk in the background
+session_cache = SessionCache(
+    history_store,
+    max_sessions=int(os.getenv("BUDDY_MAX_SESSIONS", "256")),
+    idle_seconds=int(os.getenv("BUDDY_SESSION_IDLE_SECONDS", "1800")),
+    tail_size=HISTORY_TAIL
+)
 
 BUDDY_NAME = "Buddy"
 
+# Fixed and templated lines are pre-rendered into the phrase bank at startup
+phrase_bank = PhraseBank(os.getenv("BUDDY_PHRASE_BANK", "phrase_bank"), sample_rate=SAMPLE_RATE)
+GREETING = PhraseTemplate("Hi {name}! It's great to meet you! How was your day?")
+DIDNT_HEAR = "I couldn't hear that clearly. Could you try saying that again?"
+LLM_UNAVAILABLE = "Oops! My imagination took a little break. Can you say that again?"
+
+# Concurrency settings: how many sessions may run a handler at once, how many
+# requests may wait in the queue, and how many TTS jobs run in parallel
+CONCURRENCY_LIMIT = int(os.getenv("BUDDY_CONCURRENCY_LIMIT", "8"))
+MAX_QUEUE_SIZE = int(os.getenv("BUDDY_MAX_QUEUE_SIZE", "64"))
+TTS_WORKERS = int(os.getenv("BUDDY_TTS_WORKERS", "2"))
+
+# Stream audio sentence by sentence instead of waiting for the full response
+STREAMING_AUDIO = os.getenv("BUDDY_STREAMING_AUDIO", "1") == "1"
+
+# Synthesized speech is trimmed of leading/trailing silence and normalized to
+# one loudness across voices; set an output rate to also resample it down
+TARGET_LOUDNESS_DB = float(os.getenv("BUDDY_TARGET_LOUDNESS_DB", "-20"))
+OUTPUT_SAMPLE_RATE = int(os.getenv("BUDDY_OUTPUT_SAMPLE_RATE", "0")) or None
+
+# Kid messages and Buddy's replies are checked locally before any Gemini or
+# TTS call; unsafe turns get a redirect line from the phrase bank
+safety = SafetyFilter(os.getenv("BUDDY_SAFETY_BLOCKLIST"))
+
+# Every turn and its stages are traced to a rotating JSONL file; summarize it
+# with `python tracing.py report`
+tracer = Tracer(
+    os.getenv("BUDDY_TRACE_FILE", "traces.jsonl"),
+    max_bytes=int(os.getenv("BUDDY_TRACE_MAX_BYTES", "5000000")),
+    backups=int(os.getenv("BUDDY_TRACE_BACKUPS", "3")),
+    enabled=os.getenv("BUDDY_TRACING", "1") == "1"
+)
+
 class EmotionalSpeech:
     def __init__(self):
-        # Preload Bark models
-        preload_models()
-        
         self.emotions = {
             "happy": {"voice_preset": "v2/en_speaker_6", "speed": 1.2},
             "sad": {"voice_preset": "v2/en_speaker_3", "speed": 0.8},
@@ -73,38 +156,44 @@ class EmotionalSpeech:
         ]
     
     def detect_emotion(self, text):
-        keywords = {
-            "happy": ["yay", "wonderful", "happy", "joy", "excited", "great"],
-            "sad": ["sad", "sorry", "unfortunate", "miss", "difficult"],
-            "excited": ["wow", "amazing", "awesome", "incredible", "fantastic"],
-            "calm": ["gentle", "peaceful", "quiet", "soft"],
-            "singing": ["🎵", "sing", "song", "la la", "tune"],
-            "storytelling": ["once upon a time", "story", "tale", "chapter"]
-        }
-        
-        text_lower = text.lower()
-        for emotion, words in keywords.items():
-            if any(word in text_lower for word in words):
-                return emotion
-        return "calm"
+        return buddy_matcher.match(text).best("emotion", "calm")
 
     def synthesize(self, text, emotion=None):
+        with tracer.span("synthesize", chars=len(text)) as span:
+            audio = self._synthesize(text, emotion, span)
+            if audio is None:
+                span.fail("every TTS tier failed")
+            return audio
+
+    def _synthesize(self, text, emotion, span):
         # Detect emotion if not provided
         if emotion is None:
             emotion = self.detect_emotion(text)
-<<<<<<< HEAD
+        span.set(emotion=emotion)
         
         # Get emotion parameters
         params = self.emotions.get(emotion, self.emotions["calm"])
+
+        # Fixed lines play straight from the phrase bank
+        prerendered = phrase_bank.path(text, emotion)
+        if prerendered is not None:
+            span.set(tier="phrase_bank")
+            return prerendered
         
         try:
             # Generate audio with Bark
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                audio_array = generate_audio(
-                    text, 
-                    history_prompt=params["voice_preset"]
+            span.set(tier="bark")
+            with tracer.span("tts.bark"), tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+                if model_client:
+                    model_client.synthesize(
+                        "bark", text, temp_file.name, voice_preset=params["voice_preset"]
+                    )
+                    return postprocess_file(temp_file.name, OUTPUT_SAMPLE_RATE, TARGET_LOUDNESS_DB)
+                audio_array, sample_rate = postprocess(
+                    bark_generate(text, params["voice_preset"]), SAMPLE_RATE,
+                    OUTPUT_SAMPLE_RATE, TARGET_LOUDNESS_DB
                 )
-                sf.write(temp_file.name, audio_array, SAMPLE_RATE)
+                sf.write(temp_file.name, audio_array, sample_rate, subtype="PCM_16")
                 return temp_file.name
         
         except Exception as bark_error:
@@ -112,165 +201,343 @@ class EmotionalSpeech:
         
         try:
             # Fallback to Glow-TTS
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                self.tts.tts_to_file(
-                    text=f"{random.choice(self.fallback_explanations)} {text}",
-                    file_path=temp_file.name,
-                    speed=params["speed"]
-                )
-                return temp_file.name
+            explanation = random.choice(self.fallback_explanations)
+            prerendered = phrase_bank.get(explanation, emotion)
+            span.set(tier="glow")
+            if prerendered is not None:
+                # Only the response itself needs Glow-TTS; the explanation
+                # comes from the phrase bank
+                with tracer.span("tts.glow", spliced=True):
+                    audio, sample_rate = self.render_fallback(text, params["speed"])
+                    return phrase_bank.save(phrase_bank.splice(prerendered, (sample_rate, audio)))
+
+            with tracer.span("tts.glow"), tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+                fallback_text = f"{explanation} {text}"
+                if model_client:
+                    model_client.synthesize(
+                        "glow", fallback_text, temp_file.name, speed=params["speed"]
+                    )
+                else:
+                    with torch.inference_mode():
+                        tts.tts_to_file(
+                            text=fallback_text,
+                            file_path=temp_file.name,
+                            speed=params["speed"]
+                        )
+                return postprocess_file(temp_file.name, OUTPUT_SAMPLE_RATE, TARGET_LOUDNESS_DB)
         
         except Exception as glow_error:
             print(f"Glow-TTS generation error: {glow_error}")
             
-=======
-        
-        # Preprocess text to handle short inputs
-        text = self.preprocess_text(text)
-
-        try:
-            # Generate audio using Bark
-            audio_array = generate_audio(text)
-            temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-            write_wav(temp_file.name, SAMPLE_RATE, audio_array)
-            return temp_file.name
-        except Exception as e:
-            print(f"Bark TTS error: {e}")
-            # Fall back to gTTS for very short texts or if Glow-TTS fails
->>>>>>> 1d186285b6ffdbe627e9c3120eaba79bd0ce670b
             try:
                 # Final fallback to gTTS
-                temp_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
-                tts_fallback = gTTS(
-                    text=f"{random.choice(self.fallback_explanations)} {text}", 
-                    lang='en', 
-                    tld='com', 
-                    slow=False
-                )
-                tts_fallback.save(temp_file.name)
-                return temp_file.name
+                span.set(tier="gtts")
+                with tracer.span("tts.gtts"):
+                    temp_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
+                    tts_fallback = gTTS(
+                        text=f"{explanation} {text}", 
+                        lang='en', 
+                        tld='com', 
+                        slow=False
+                    )
+                    tts_fallback.save(temp_file.name)
+                    return temp_file.name
             
             except Exception as final_error:
                 print(f"Final TTS fallback error: {final_error}")
+                span.set(tier=None)
                 return None
 
+    def render(self, text, emotion):
+        """
+        Synthesizes `text` with Bark and returns (samples, sample_rate), for the phrase bank.
+        """
+        params = self.emotions.get(emotion, self.emotions["calm"])
+        if model_client:
+            with tempfile.NamedTemporaryFile(suffix=".wav") as temp_file:
+                model_client.synthesize("bark", text, temp_file.name, voice_preset=params["voice_preset"])
+                audio, sample_rate = sf.read(temp_file.name)
+        else:
+            audio, sample_rate = bark_generate(text, params["voice_preset"]), SAMPLE_RATE
+        # The bank resamples to its own rate, so only trim and normalize here
+        return postprocess(audio, sample_rate, target_db=TARGET_LOUDNESS_DB)
+
+    def render_fallback(self, text, speed):
+        """
+        Synthesizes `text` with Glow-TTS and returns (samples, sample_rate).
+        """
+        if model_client:
+            with tempfile.NamedTemporaryFile(suffix=".wav") as temp_file:
+                model_client.synthesize("glow", text, temp_file.name, speed=speed)
+                audio, sample_rate = sf.read(temp_file.name)
+        else:
+            with torch.inference_mode():
+                audio, sample_rate = np.asarray(tts.tts(text=text, speed=speed)), tts.synthesizer.output_sample_rate
+        return postprocess(audio, sample_rate, target_db=TARGET_LOUDNESS_DB)
+
+    def prerender(self):
+        """
+        Fills the phrase bank with every fixed line for every emotion preset,
+        in the background.
+        """
+        phrases = self.fallback_explanations + [DIDNT_HEAR, LLM_UNAVAILABLE] + GREETING.fixed_parts + safety.redirect_phrases()
+        phrase_bank.build_in_background(phrases, list(self.emotions), self.render)
+
+BUDDY_PROMPT = """
+You are Buddy, a friendly voice assistant for children aged 4-10.
+
+Please ensure your responses are at least a few words long to help with speech synthesis.
+
+Continue the conversation naturally. Use emojis to indicate emotions and tone:
+- 😊 for happy responses
+- 🎵 for singing
+- 📖 for storytelling
+- 😃 for excited responses
+- 😢 for empathetic/sad responses
+- 😌 for calm/soothing responses
+
+Make learning fun, and ensure responses are age-appropriate and friendly.
+"""
+
+# The static instructions above go to Gemini once, as a cached context or a
+# system instruction ("cached", "system", "inline", "local" or "auto"), and
+# each call carries only the per-child part
+PROMPT_CACHE_MODE = os.getenv("BUDDY_PROMPT_CACHE", "auto")
+chat_model = PrefixCachedModel(
+    GEMINI_MODEL, BUDDY_PROMPT, name="buddy", mode=PROMPT_CACHE_MODE,
+    cache_model=os.getenv("BUDDY_PROMPT_CACHE_MODEL")
+)
+
+def buddy_instructions(user_name):
+    return f"Current user's name: {user_name}."
+
+# One Gemini conversation per child; older turns are summarized once the
+# token budget is exceeded
+conversations = ConversationManager(
+    chat_model,
+    buddy_instructions,
+    summary_model=model,
+    token_budget=int(os.getenv("BUDDY_TOKEN_BUDGET", "1500"))
+)
+
 class BuddyBear:
     def __init__(self):
-        self.user_name = None
         self.speech_synthesizer = EmotionalSpeech()
 
-    def format_response(self, user_input, history):
-        recent_history = history[-4:] if history else []
-        history_context = "\n".join([
-            f"{'Child' if msg['role'] == 'user' else BUDDY_NAME}: {msg['content']}"
-            for msg in recent_history
-        ])
-
-        context = f"""
-        You are Buddy, a friendly voice assistant for children aged 4-10.
-        Current user's name: {self.user_name or 'unknown'}.
-        
-        Please ensure your responses are at least a few words long to help with speech synthesis.
-
-        Recent conversation:
-        {history_context}
-
-        Child's message: {user_input}
-
-        Continue the conversation naturally. Use emojis to indicate emotions and tone:
-        - 😊 for happy responses
-        - 🎵 for singing
-        - 📖 for storytelling
-        - 😃 for excited responses
-        - 😢 for empathetic/sad responses
-        - 😌 for calm/soothing responses
+    def format_response(self, user_input, history, user_name=None):
+        verdict = safety.check(user_input)
+        if not verdict.safe:
+            tracer.annotate(blocked=verdict.category)
+            return safety.redirect(verdict.category)
 
-        Make learning fun, and ensure responses are age-appropriate and friendly.
-        """
+        with tracer.span("format_response") as span:
+            try:
+                conversation = conversations.get(user_name or "unknown", history)
+                reply = conversation.send(user_input, review=self.review_reply)
+            except Exception as e:
+                # Includes blocked responses, whose .text raises ValueError
+                print(f"Gemini API error: {e}")
+                span.fail(e)
+                return LLM_UNAVAILABLE
+            span.set(chars=len(reply))
+            return reply
+
+    def review_reply(self, reply):
+        verdict = safety.check(reply, stage="output")
+        if verdict.safe:
+            return reply
+        tracer.annotate(blocked_reply=verdict.category)
+        return safety.redirect()
+
+    def content_emotion(self, text):
+        # Detect if the text contains special content types
+        if "🎵" in text:
+            return "singing"
+        elif "📖" in text:
+            return "storytelling"
+        # Let the EmotionalSpeech class detect the emotion
+        return None
+
+    def generate_voice(self, text, emotion=None):
+        with tracer.span("generate_voice") as span:
+            try:
+                # Add some padding for very short responses
+                if len(text.strip()) < 3:
+                    text = f"{text.strip()} . . ."
 
-        response = model.generate_content(context)
-        return response.text
+                return self.speech_synthesizer.synthesize(text, emotion or self.content_emotion(text))
+            except Exception as e:
+                print(f"TTS error: {e}")
+                # Final fallback to pyttsx3
+                try:
+                    with tracer.span("tts.pyttsx3"):
+                        span.set(tier="pyttsx3")
+                        temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+                        engine = pyttsx3.init()
+                        engine.save_to_file(text, temp_file.name)
+                        engine.runAndWait()
+                        return postprocess_file(temp_file.name, OUTPUT_SAMPLE_RATE, TARGET_LOUDNESS_DB)
+                except Exception as e:
+                    print(f"pyttsx3 error: {e}")
+                    span.fail(e)
+                    return None
 
-    def generate_voice(self, text):
-        try:
-            # Add some padding for very short responses
-            if len(text.strip()) < 3:
-                text = f"{text.strip()} . . ."
-                
-            # Detect if the text contains special content types
-            if "🎵" in text:
-                return self.speech_synthesizer.synthesize(text, "singing")
-            elif "📖" in text:
-                return self.speech_synthesizer.synthesize(text, "storytelling")
-            else:
-                # Let the EmotionalSpeech class detect the emotion
-                return self.speech_synthesizer.synthesize(text)
-        except Exception as e:
-            print(f"TTS error: {e}")
-            # Final fallback to pyttsx3
+    def transcribe_audio(self, audio_file):
+        with tracer.span("transcribe_audio") as span:
             try:
-                temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-                engine = pyttsx3.init()
-                engine.save_to_file(text, temp_file.name)
-                engine.runAndWait()
-                return temp_file.name
+                with sr.AudioFile(audio_file) as source:
+                    audio = recognizer.record(source)
+                    text = recognizer.recognize_google(audio)
+                    span.set(chars=len(text))
+                    return text
             except Exception as e:
-                print(f"pyttsx3 error: {e}")
+                print(f"Speech recognition error: {e}")
+                span.fail(e)
                 return None
 
-    def transcribe_audio(self, audio_file):
-        try:
-            with sr.AudioFile(audio_file) as source:
-                audio = recognizer.record(source)
-                text = recognizer.recognize_google(audio)
-                return text
-        except Exception as e:
-            print(f"Speech recognition error: {e}")
-            return None
-
 class ChatInterface:
     def __init__(self):
         self.buddy = BuddyBear()
+        # Bark/Glow-TTS are the heavy stage, so they get their own bounded pool
+        # while other sessions keep talking to Gemini
+        self.tts_pool = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="buddy-tts")
+        self.buddy.speech_synthesizer.prerender()
 
-    def save_chat_history(self, chat_history):
-        if not self.buddy.user_name:
+    @staticmethod
+    def new_session():
+        return {"user_name": None}
+
+    def generate_voice(self, text):
+        return tracer.submit(self.tts_pool, self.buddy.generate_voice, text).result()
+
+    def greet(self, user_name):
+        # Splice the name into the pre-rendered greeting; fall back to
+        # synthesizing the whole line while the bank is still being built
+        greeting = GREETING.format(user_name)
+        synthesizer = self.buddy.speech_synthesizer
+        emotion = synthesizer.detect_emotion(greeting)
+        with tracer.span("greet") as span:
+            try:
+                audio = phrase_bank.save(tracer.submit(
+                    self.tts_pool, GREETING.render, phrase_bank, user_name, emotion, synthesizer.render
+                ).result())
+            except Exception as e:
+                print(f"Greeting splice error: {e}")
+                audio = None
+            span.set(spliced=audio is not None)
+            return greeting, audio or self.generate_voice(greeting)
+
+    def generate_voice_stream(self, text, parent=None):
+        # Queue every sentence up front so synthesis of the next sentence
+        # overlaps playback of the current one
+        emotion = self.buddy.content_emotion(text)
+        # Fixed lines (e.g. safety redirects) are already rendered whole
+        if phrase_bank.get(text, emotion or self.buddy.speech_synthesizer.detect_emotion(text)) is not None:
+            yield self.generate_voice(text)
             return
-        filename = chat_history_dir / f"{self.buddy.user_name}_chat.json"
-        with open(filename, "w") as f:
-            json.dump(chat_history, f)
-
-    def load_chat_history(self):
-        if not self.buddy.user_name:
-            return []
-        filename = chat_history_dir / f"{self.buddy.user_name}_chat.json"
-        if filename.exists():
-            with open(filename) as f:
-                return json.load(f)
-        return []
-
-    def process_message(self, message, history):
-        if not self.buddy.user_name:
-            self.buddy.user_name = message
-            greeting = f"Hi {self.buddy.user_name}! It's great to meet you! How was your day?"
-            audio_path = self.buddy.generate_voice(greeting)
-            return "", audio_path, [{"role": "assistant", "content": greeting}]
-
-        history = history or self.load_chat_history()
-        response = self.buddy.format_response(message, history)
-        audio_path = self.buddy.generate_voice(response)
-
-        history.append({"role": "user", "content": message})
-        history.append({"role": "assistant", "content": response})
-        self.save_chat_history(history)
-
-        return "", audio_path, history
-
-    def process_voice_message(self, audio_file, history):
-        transcribed_text = self.buddy.transcribe_audio(audio_file)
-        if not transcribed_text:
-            return "I couldn't hear that clearly. Could you try saying that again?", None, history
-
-        return self.process_message(transcribed_text, history)
+        futures = [
+            tracer.submit(self.tts_pool, self.buddy.generate_voice, sentence, emotion, parent=parent)
+            for sentence in split_sentences(text)
+        ]
+        for future in futures:
+            audio_path = future.result()
+            if audio_path:
+                yield audio_path
+
+    def save_chat_history(self, user_name, turn):
+        with tracer.span("save_chat_history"):
+            session_cache.append(user_name, turn)
+
+    def load_chat_history(self, user_name):
+        with tracer.span("load_chat_history") as span:
+            history = session_cache.get(user_name)
+            span.set(messages=len(history))
+            return history
+
+    def process_message(self, message, history, session):
+        with tracer.span("turn", kind="text"):
+            return self.respond(message, history, session)
+
+    def respond(self, message, history, session):
+        session = session or self.new_session()
+        if not session["user_name"]:
+            session["user_name"] = message
+            tracer.annotate(user=user_key(message))
+            session_cache.prefetch(message)
+            greeting, audio_path = self.greet(message)
+            return "", audio_path, [{"role": "assistant", "content": greeting}], session
+
+        user_name = session["user_name"]
+        tracer.annotate(user=user_key(user_name))
+        history = history or self.load_chat_history(user_name)
+        response = self.buddy.format_response(message, history, user_name)
+        audio_path = self.generate_voice(response)
+
+        turn = [{"role": "user", "content": message}, {"role": "assistant", "content": response}]
+        history.extend(turn)
+        self.save_chat_history(user_name, turn)
+
+        return "", audio_path, history, session
+
+    def process_voice_message(self, audio_file, history, session):
+        with tracer.span("turn", kind="voice"):
+            transcribed_text = self.buddy.transcribe_audio(audio_file)
+            if not transcribed_text:
+                return DIDNT_HEAR, self.generate_voice(DIDNT_HEAR), history, session
+
+            return self.respond(transcribed_text, history, session)
+
+    def process_message_stream(self, message, history, session):
+        # A generator may resume on a different thread for every step, so the
+        # turn span is begun and ended explicitly and re-activated per step
+        turn = tracer.span("turn", kind="text", streaming=True).begin()
+        try:
+            yield from self.respond_stream(message, history, session, turn)
+        finally:
+            turn.end()
+
+    def respond_stream(self, message, history, session, turn):
+        session = session or self.new_session()
+        if not session["user_name"]:
+            session["user_name"] = message
+            turn.set(user=user_key(message))
+            session_cache.prefetch(message)
+            with tracer.activate(turn):
+                greeting, audio = self.greet(message)
+            yield "", audio, [{"role": "assistant", "content": greeting}], session
+            return
+
+        user_name = session["user_name"]
+        turn.set(user=user_key(user_name))
+        with tracer.activate(turn):
+            history = list(history or self.load_chat_history(user_name))
+            reply = self.buddy.format_response(message, history, user_name)
+
+            turn_messages = [{"role": "user", "content": message}, {"role": "assistant", "content": reply}]
+            history.extend(turn_messages)
+            self.save_chat_history(user_name, turn_messages)
+
+        # Show the text right away, then stream audio sentence by sentence
+        yield "", None, history, session
+        for audio_path in self.generate_voice_stream(reply, parent=turn):
+            if "first_audio_ms" not in turn.attrs:
+                turn.set(first_audio_ms=round(turn.elapsed_ms(), 1))
+            yield "", audio_path, history, session
+
+    def process_voice_message_stream(self, audio_file, history, session):
+        turn = tracer.span("turn", kind="voice", streaming=True).begin()
+        try:
+            with tracer.activate(turn):
+                transcribed_text = self.buddy.transcribe_audio(audio_file)
+                if not transcribed_text:
+                    audio = self.generate_voice(DIDNT_HEAR)
+            if not transcribed_text:
+                yield DIDNT_HEAR, audio, history, session
+                return
+
+            yield from self.respond_stream(transcribed_text, history, session, turn)
+        finally:
+            turn.end()
 
     def create_interface(self):
         with gr.Blocks(theme=gr.themes.Soft()) as interface:
@@ -295,27 +562,38 @@ class ChatInterface:
                 )
                 clear = gr.Button("Start Over")
 
-            audio_output = gr.Audio(label="Listen to my response!")
+            audio_output = gr.Audio(
+                label="Listen to my response!", streaming=STREAMING_AUDIO, autoplay=STREAMING_AUDIO
+            )
+
+            # Each browser session gets its own copy of this state
+            session = gr.State(self.new_session())
+
+            if STREAMING_AUDIO:
+                text_handler, voice_handler = self.process_message_stream, self.process_voice_message_stream
+            else:
+                text_handler, voice_handler = self.process_message, self.process_voice_message
 
             msg.submit(
-                self.process_message,
-                inputs=[msg, chatbot],
-                outputs=[msg, audio_output, chatbot]
+                text_handler,
+                inputs=[msg, chatbot, session],
+                outputs=[msg, audio_output, chatbot, session],
+                concurrency_limit=CONCURRENCY_LIMIT
             )
 
             audio_msg.stop_recording(
-                self.process_voice_message,
-                inputs=[audio_msg, chatbot],
-                outputs=[msg, audio_output, chatbot]
+                voice_handler,
+                inputs=[audio_msg, chatbot, session],
+                outputs=[msg, audio_output, chatbot, session],
+                concurrency_limit=CONCURRENCY_LIMIT
             )
 
             def clear_chat():
-                self.buddy.user_name = None
-                return None, None, None
+                return None, None, None, self.new_session()
 
             clear.click(
                 clear_chat,
-                outputs=[msg, audio_output, chatbot]
+                outputs=[msg, audio_output, chatbot, session]
             )
 
         return interface
@@ -323,6 +601,7 @@ class ChatInterface:
 def main():
     chat_interface = ChatInterface()
     demo = chat_interface.create_interface()
+    demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT, max_size=MAX_QUEUE_SIZE)
     demo.launch(share=True)
 
 if __name__ == "__main__":
@@ -5,18 +5,21 @@ from gtts import gTTS
 import pyttsx3
 import os
 from pathlib import Path
-import json
-from datetime import datetime
 from dotenv import load_dotenv
 import torch
 from TTS.api import TTS
-import numpy as np
-from scipy.io import wavfile
 import tempfile
 from bark import generate_audio, preload_models, SAMPLE_RATE
 import soundfile as sf
 import random
-import whisper  # Import Whisper for STT
+from history_store import ChatHistoryStore
+from keyword_matcher import buddy_matcher
+from model_client import ModelClient
+from session_cache import SessionCache
+from stt import SpeechToText
+from tracing import Tracer, user_key
+from safety import SafetyFilter
+from prompt_cache import PrefixCachedModel
 
 # Optional: Suppress the specific FutureWarning from torch.load in Bark
 warnings.filterwarnings(
@@ -30,17 +33,60 @@ load_dotenv()
 # Configuration
 gemini_key = os.getenv('GEMINI_API_KEY')
 genai.configure(api_key=gemini_key)
-model = genai.GenerativeModel('gemini-pro')
-
-# Initialize Coqui TTS with Glow-TTS model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-tts = TTS("tts_models/en/ljspeech/glow-tts").to(device)
+# Needs a model that takes a system instruction (1.5 or newer)
+GEMINI_MODEL = os.getenv("BUDDY_GEMINI_MODEL", "gemini-1.5-flash")
+model = genai.GenerativeModel(GEMINI_MODEL)
+
+BUDDY_PROMPT = """
+You are Buddy, a friendly voice assistant for children aged 4-10.
+
+Please ensure your responses are at least a few words long to help with speech synthesis.
+
+Continue the conversation naturally. Use emojis to indicate emotions and tone:
+- 😊 for happy responses
+- 🎵 for singing
+- 📖 for storytelling
+- 😃 for excited responses
+- 😢 for empathetic/sad responses
+- 😌 for calm/soothing responses
+
+Make learning fun, and ensure responses are age-appropriate and friendly.
+"""
+
+# The static instructions go to Gemini once (cached context or system
+# instruction); each call only carries the child's name, recent turns and message
+chat_model = PrefixCachedModel(
+    GEMINI_MODEL, BUDDY_PROMPT, name="buddy", mode=os.getenv("BUDDY_PROMPT_CACHE", "auto"),
+    cache_model=os.getenv("BUDDY_PROMPT_CACHE_MODEL")
+)
 
-# Preload Bark models
-preload_models()
+# When a shared model server is running, use it instead of loading our own
+# copies of Bark, Glow-TTS and Whisper
+MODEL_SERVER_URL = os.getenv("DIGIMATE_MODEL_SERVER")
+model_client = ModelClient(MODEL_SERVER_URL) if MODEL_SERVER_URL else None
 
-# Load OpenAI Whisper model (using the 'base' model; change as needed)
-whisper_model = whisper.load_model("base")
+device = "cuda" if torch.cuda.is_available() else "cpu"
+if model_client is None:
+    # Initialize Coqui TTS with Glow-TTS model
+    tts = TTS("tts_models/en/ljspeech/glow-tts").to(device)
+
+    # Preload Bark models
+    preload_models()
+
+# Load the Whisper model. Backend, model size and precision are configurable;
+# int8 on CPU is the fast default. With a model server, transcription runs there
+if model_client:
+    stt = SpeechToText(backend="remote", client=model_client)
+else:
+    stt = SpeechToText(
+        model_size=os.getenv("WHISPER_MODEL", "base"),
+        backend=os.getenv("WHISPER_BACKEND", "faster-whisper"),
+        device=device,
+        compute_type=os.getenv("WHISPER_COMPUTE_TYPE", "int8" if device == "cpu" else "float16")
+    )
+
+# Transcribe while the child is still talking instead of after recording stops
+STT_STREAMING = os.getenv("BUDDY_STT_STREAMING", "1") == "1"
 
 # Directory setup
 responses_dir = Path("responses")
@@ -48,9 +94,34 @@ responses_dir.mkdir(exist_ok=True)
 
 chat_history_dir = Path("chat_history")
 chat_history_dir.mkdir(exist_ok=True)
+history_store = ChatHistoryStore(chat_history_dir)
+
+# Number of recent messages loaded when a returning child starts a new session
+HISTORY_TAIL = int(os.getenv("BUDDY_HISTORY_TAIL", "20"))
+
+# Active conversations stay in memory; turns are written to disk in the background
+session_cache = SessionCache(
+    history_store,
+    max_sessions=int(os.getenv("BUDDY_MAX_SESSIONS", "256")),
+    idle_seconds=int(os.getenv("BUDDY_SESSION_IDLE_SECONDS", "1800")),
+    tail_size=HISTORY_TAIL
+)
 
 BUDDY_NAME = "Buddy"
 
+# Kid messages and Buddy's replies are checked locally before any Gemini or
+# TTS call; unsafe turns get a redirect line instead
+safety = SafetyFilter(os.getenv("BUDDY_SAFETY_BLOCKLIST"))
+
+# Every turn and its stages are traced to a rotating JSONL file; summarize it
+# with `python tracing.py report`
+tracer = Tracer(
+    os.getenv("BUDDY_TRACE_FILE", "traces.jsonl"),
+    max_bytes=int(os.getenv("BUDDY_TRACE_MAX_BYTES", "5000000")),
+    backups=int(os.getenv("BUDDY_TRACE_BACKUPS", "3")),
+    enabled=os.getenv("BUDDY_TRACING", "1") == "1"
+)
+
 class EmotionalSpeech:
     def __init__(self):
         self.emotions = {
@@ -71,32 +142,32 @@ class EmotionalSpeech:
         ]
     
     def detect_emotion(self, text):
-        keywords = {
-            "happy": ["yay", "wonderful", "happy", "joy", "excited", "great"],
-            "sad": ["sad", "sorry", "unfortunate", "miss", "difficult"],
-            "excited": ["wow", "amazing", "awesome", "incredible", "fantastic"],
-            "calm": ["gentle", "peaceful", "quiet", "soft"],
-            "singing": ["🎵", "sing", "song", "la la", "tune"],
-            "storytelling": ["once upon a time", "story", "tale", "chapter"]
-        }
-        
-        text_lower = text.lower()
-        for emotion, words in keywords.items():
-            if any(word in text_lower for word in words):
-                return emotion
-        return "calm"
+        return buddy_matcher.match(text).best("emotion", "calm")
 
     def synthesize(self, text, emotion=None):
+        with tracer.span("synthesize", chars=len(text)) as span:
+            audio = self._synthesize(text, emotion, span)
+            if audio is None:
+                span.fail("every TTS tier failed")
+            return audio
+
+    def _synthesize(self, text, emotion, span):
         # Detect emotion if not provided
         if emotion is None:
             emotion = self.detect_emotion(text)
+        span.set(emotion=emotion)
         
         # Get emotion parameters
         params = self.emotions.get(emotion, self.emotions["calm"])
         
         try:
             # Generate audio with Bark
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+            span.set(tier="bark")
+            with tracer.span("tts.bark"), tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+                if model_client:
+                    return model_client.synthesize(
+                        "bark", text, temp_file.name, voice_preset=params["voice_preset"]
+                    )
                 audio_array = generate_audio(
                     text, 
                     history_prompt=params["voice_preset"]
@@ -109,9 +180,15 @@ class EmotionalSpeech:
         
         try:
             # Fallback to Glow-TTS
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+            span.set(tier="glow")
+            with tracer.span("tts.glow"), tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+                fallback_text = f"{random.choice(self.fallback_explanations)} {text}"
+                if model_client:
+                    return model_client.synthesize(
+                        "glow", fallback_text, temp_file.name, speed=params["speed"]
+                    )
                 tts.tts_to_file(
-                    text=f"{random.choice(self.fallback_explanations)} {text}",
+                    text=fallback_text,
                     file_path=temp_file.name,
                     speed=params["speed"]
                 )
@@ -122,18 +199,21 @@ class EmotionalSpeech:
             
             try:
                 # Final fallback to gTTS
-                temp_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
-                tts_fallback = gTTS(
-                    text=f"{random.choice(self.fallback_explanations)} {text}", 
-                    lang='en', 
-                    tld='com', 
-                    slow=False
-                )
-                tts_fallback.save(temp_file.name)
-                return temp_file.name
+                span.set(tier="gtts")
+                with tracer.span("tts.gtts"):
+                    temp_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
+                    tts_fallback = gTTS(
+                        text=f"{random.choice(self.fallback_explanations)} {text}", 
+                        lang='en', 
+                        tld='com', 
+                        slow=False
+                    )
+                    tts_fallback.save(temp_file.name)
+                    return temp_file.name
             
             except Exception as final_error:
                 print(f"Final TTS fallback error: {final_error}")
+                span.set(tier=None)
                 return None
 
 class BuddyBear:
@@ -142,117 +222,143 @@ class BuddyBear:
         self.speech_synthesizer = EmotionalSpeech()
 
     def format_response(self, user_input, history):
+        verdict = safety.check(user_input)
+        if not verdict.safe:
+            tracer.annotate(blocked=verdict.category)
+            return safety.redirect(verdict.category)
+
         recent_history = history[-4:] if history else []
         history_context = "\n".join([
             f"{'Child' if msg['role'] == 'user' else BUDDY_NAME}: {msg['content']}"
             for msg in recent_history
         ])
 
-        context = f"""
-        You are Buddy, a friendly voice assistant for children aged 4-10.
-        Current user's name: {self.user_name or 'unknown'}.
-        
-        Please ensure your responses are at least a few words long to help with speech synthesis.
-
-        Recent conversation:
-        {history_context}
-
-        Child's message: {user_input}
+        context = (
+            f"Current user's name: {self.user_name or 'unknown'}.\n\n"
+            f"Recent conversation:\n{history_context}\n\n"
+            f"Child's message: {user_input}"
+        )
 
-        Continue the conversation naturally. Use emojis to indicate emotions and tone:
-        - 😊 for happy responses
-        - 🎵 for singing
-        - 📖 for storytelling
-        - 😃 for excited responses
-        - 😢 for empathetic/sad responses
-        - 😌 for calm/soothing responses
+        with tracer.span("format_response") as span:
+            response = chat_model.generate_content(context)
+            span.set(chars=len(response.text), mode=chat_model.mode)
 
-        Make learning fun, and ensure responses are age-appropriate and friendly.
-        """
-
-        response = model.generate_content(context)
+        verdict = safety.check(response.text, stage="output")
+        if not verdict.safe:
+            tracer.annotate(blocked_reply=verdict.category)
+            return safety.redirect()
         return response.text
 
     def generate_voice(self, text):
-        try:
-            # Add some padding for very short responses
-            if len(text.strip()) < 3:
-                text = f"{text.strip()} . . ."
-                
-            # Detect if the text contains special content types
-            if "🎵" in text:
-                return self.speech_synthesizer.synthesize(text, "singing")
-            elif "📖" in text:
-                return self.speech_synthesizer.synthesize(text, "storytelling")
-            else:
-                # Let the EmotionalSpeech class detect the emotion
-                return self.speech_synthesizer.synthesize(text)
-        except Exception as e:
-            print(f"TTS error: {e}")
-            # Final fallback to pyttsx3
+        with tracer.span("generate_voice") as span:
             try:
-                temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-                engine = pyttsx3.init()
-                engine.save_to_file(text, temp_file.name)
-                engine.runAndWait()
-                return temp_file.name
+                # Add some padding for very short responses
+                if len(text.strip()) < 3:
+                    text = f"{text.strip()} . . ."
+                    
+                # Detect if the text contains special content types
+                if "🎵" in text:
+                    return self.speech_synthesizer.synthesize(text, "singing")
+                elif "📖" in text:
+                    return self.speech_synthesizer.synthesize(text, "storytelling")
+                else:
+                    # Let the EmotionalSpeech class detect the emotion
+                    return self.speech_synthesizer.synthesize(text)
             except Exception as e:
-                print(f"pyttsx3 error: {e}")
-                return None
+                print(f"TTS error: {e}")
+                # Final fallback to pyttsx3
+                try:
+                    with tracer.span("tts.pyttsx3"):
+                        span.set(tier="pyttsx3")
+                        temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+                        engine = pyttsx3.init()
+                        engine.save_to_file(text, temp_file.name)
+                        engine.runAndWait()
+                        return temp_file.name
+                except Exception as e:
+                    print(f"pyttsx3 error: {e}")
+                    span.fail(e)
+                    return None
 
     def transcribe_audio(self, audio_file):
-        try:
-            # Use OpenAI Whisper for transcription
-            result = whisper_model.transcribe(audio_file)
-            text = result["text"].strip()
-            return text
-        except Exception as e:
-            print(f"Whisper transcription error: {e}")
-            return None
+        with tracer.span("transcribe_audio") as span:
+            try:
+                # Use Whisper for transcription
+                return stt.transcribe_file(audio_file)
+            except Exception as e:
+                print(f"Whisper transcription error: {e}")
+                span.fail(e)
+                return None
+
+    def finish_transcription(self, transcriber):
+        with tracer.span("transcribe_audio", streaming=True) as span:
+            try:
+                return transcriber.finish()
+            except Exception as e:
+                print(f"Whisper transcription error: {e}")
+                span.fail(e)
+                return None
 
 class ChatInterface:
     def __init__(self):
         self.buddy = BuddyBear()
 
-    def save_chat_history(self, chat_history):
-        if not self.buddy.user_name:
-            return
-        filename = chat_history_dir / f"{self.buddy.user_name}_chat.json"
-        with open(filename, "w") as f:
-            json.dump(chat_history, f)
+    def save_chat_history(self, turn):
+        with tracer.span("save_chat_history"):
+            session_cache.append(self.buddy.user_name, turn)
 
     def load_chat_history(self):
-        if not self.buddy.user_name:
-            return []
-        filename = chat_history_dir / f"{self.buddy.user_name}_chat.json"
-        if filename.exists():
-            with open(filename) as f:
-                return json.load(f)
-        return []
+        with tracer.span("load_chat_history") as span:
+            history = session_cache.get(self.buddy.user_name)
+            span.set(messages=len(history))
+            return history
 
     def process_message(self, message, history):
+        with tracer.span("turn", kind="text"):
+            return self.respond(message, history)
+
+    def respond(self, message, history):
         if not self.buddy.user_name:
             self.buddy.user_name = message
+            tracer.annotate(user=user_key(message))
+            session_cache.prefetch(message)
             greeting = f"Hi {self.buddy.user_name}! It's great to meet you! How was your day?"
             audio_path = self.buddy.generate_voice(greeting)
             return "", audio_path, [{"role": "assistant", "content": greeting}]
 
+        tracer.annotate(user=user_key(self.buddy.user_name))
         history = history or self.load_chat_history()
         response = self.buddy.format_response(message, history)
         audio_path = self.buddy.generate_voice(response)
 
-        history.append({"role": "user", "content": message})
-        history.append({"role": "assistant", "content": response})
-        self.save_chat_history(history)
+        turn = [{"role": "user", "content": message}, {"role": "assistant", "content": response}]
+        history.extend(turn)
+        self.save_chat_history(turn)
 
         return "", audio_path, history
 
     def process_voice_message(self, audio_file, history):
-        transcribed_text = self.buddy.transcribe_audio(audio_file)
-        if not transcribed_text:
-            return "I couldn't hear that clearly. Could you try saying that again?", None, history
+        with tracer.span("turn", kind="voice"):
+            transcribed_text = self.buddy.transcribe_audio(audio_file)
+            if not transcribed_text:
+                return "I couldn't hear that clearly. Could you try saying that again?", None, history
 
-        return self.process_message(transcribed_text, history)
+            return self.respond(transcribed_text, history)
+
+    def stream_voice_chunk(self, chunk, transcriber):
+        if chunk is None:
+            return transcriber
+        transcriber = transcriber or stt.start_stream()
+        transcriber.feed(*chunk)
+        return transcriber
+
+    def process_streamed_voice_message(self, transcriber, history):
+        with tracer.span("turn", kind="voice", streaming=True):
+            transcribed_text = self.buddy.finish_transcription(transcriber) if transcriber else None
+            if not transcribed_text:
+                return "I couldn't hear that clearly. Could you try saying that again?", None, history, None
+
+            return *self.respond(transcribed_text, history), None
 
     def create_interface(self):
         with gr.Blocks(theme=gr.themes.Soft()) as interface:
@@ -273,7 +379,8 @@ class ChatInterface:
                     label="Send me a message!", placeholder="What's on your mind?", scale=3
                 )
                 audio_msg = gr.Audio(
-                    label="Or talk to me!", sources=["microphone"], type="filepath"
+                    label="Or talk to me!", sources=["microphone"],
+                    type="numpy" if STT_STREAMING else "filepath", streaming=STT_STREAMING
                 )
                 clear = gr.Button("Start Over")
 
@@ -285,11 +392,26 @@ class ChatInterface:
                 outputs=[msg, audio_output, chatbot]
             )
 
-            audio_msg.stop_recording(
-                self.process_voice_message,
-                inputs=[audio_msg, chatbot],
-                outputs=[msg, audio_output, chatbot]
-            )
+            if STT_STREAMING:
+                transcriber = gr.State(None)
+
+                audio_msg.stream(
+                    self.stream_voice_chunk,
+                    inputs=[audio_msg, transcriber],
+                    outputs=[transcriber]
+                )
+
+                audio_msg.stop_recording(
+                    self.process_streamed_voice_message,
+                    inputs=[transcriber, chatbot],
+                    outputs=[msg, audio_output, chatbot, transcriber]
+                )
+            else:
+                audio_msg.stop_recording(
+                    self.process_voice_message,
+                    inputs=[audio_msg, chatbot],
+                    outputs=[msg, audio_output, chatbot]
+                )
 
             def clear_chat():
                 self.buddy.user_name = None
@@ -0,0 +1,186 @@
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from prompt_cache import estimate_tokens
+
+# Rolling summaries are written off the request path
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+
+
+def alternate(turns):
+    """
+    Gemini expects turns to alternate between user and model, starting with
+    the user: drops leading model turns and merges runs of the same role.
+    """
+    merged = []
+    for turn in turns:
+        if not merged and turn["role"] == "model":
+            continue
+        if merged and merged[-1]["role"] == turn["role"]:
+            merged[-1] = {"role": turn["role"], "parts": merged[-1]["parts"] + turn["parts"]}
+        else:
+            merged.append(turn)
+    return merged
+
+
+class ConversationEngine:
+    """
+    One child's ongoing Gemini conversation.
+
+    `model` is normally a PrefixCachedModel holding the static instructions,
+    so each request carries only `instructions` (the small per-child part),
+    the profile, the summary and the recent turns. Once the turns exceed
+    `token_budget`, the oldest ones are dropped from the prompt and folded
+    into a rolling summary by a background LLM call, which takes effect on
+    the next turn after it finishes. Only the last `keep_turns` exchanges
+    stay verbatim, so the prompt stays roughly the same size however long
+    the conversation gets.
+    """
+
+    def __init__(self, model, instructions, summary_model=None, token_budget=1500, keep_turns=3):
+        self.model = model
+        self.summary_model = summary_model or model
+        self.instructions = instructions
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.profile = ""
+        self.summary = ""
+        self.turns = []
+        self.folded = []
+        self.summarizing = False
+        self.stats = deque(maxlen=100)
+        self.lock = threading.Lock()
+
+    def seed(self, history):
+        """
+        Starts the conversation from an existing chat history (role/content messages).
+        """
+        with self.lock:
+            self.turns = alternate([
+                {"role": "user" if msg["role"] == "user" else "model", "parts": [msg["content"]]}
+                for msg in history[-2 * self.keep_turns:]
+            ])
+
+    def send(self, message, note=None, review=None):
+        """
+        Sends the child's message and returns Buddy's reply. `note` carries
+        one-off instructions for this turn only (e.g. story guidelines) and is
+        not kept in the conversation. `review(reply)` may replace the reply
+        before it is kept (e.g. with a safety redirect).
+        """
+        with self.lock:
+            text = f"{note}\n\n{message}" if note else message
+            contents = self._preamble() + alternate(self.turns + [{"role": "user", "parts": [text]}])
+            prompt_bytes = sum(len(part.encode("utf-8")) for turn in contents for part in turn["parts"])
+            prefix_bytes = getattr(self.model, "prefix_bytes", 0)
+
+            response = self.model.generate_content(contents)
+            reply = response.text
+            if review is not None:
+                reply = review(reply)
+
+            usage = getattr(response, "usage_metadata", None)
+            prompt_tokens = getattr(usage, "prompt_token_count", None) or sum(
+                estimate_tokens(part) for turn in contents for part in turn["parts"]
+            )
+            cached_tokens = getattr(usage, "cached_content_token_count", None) or 0
+            self.stats.append({
+                "prompt_bytes": prompt_bytes, "prefix_bytes": prefix_bytes, "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens, "turns": len(contents)
+            })
+            print(
+                f"Gemini prompt: {prompt_bytes} bytes (+{prefix_bytes} byte static prefix), "
+                f"{prompt_tokens} tokens ({cached_tokens} cached), {len(contents)} turns"
+            )
+
+            self.turns = alternate(self.turns + [
+                {"role": "user", "parts": [message]},
+                {"role": "model", "parts": [reply]}
+            ])
+            self._compact()
+            return reply
+
+    def _preamble(self):
+        preamble = "\n\n".join(part for part in [
+            self.instructions,
+            self.profile,
+            f"What we talked about earlier: {self.summary}" if self.summary else ""
+        ] if part)
+        if not preamble:
+            return []
+        return [
+            {"role": "user", "parts": [preamble]},
+            {"role": "model", "parts": ["Okay! I'm ready to chat."]},
+        ]
+
+    def _compact(self):
+        # Called with the lock held; the summary itself runs in the background
+        used = sum(estimate_tokens(part) for turn in self.turns for part in turn["parts"])
+        if used <= self.token_budget or len(self.turns) <= 2 * self.keep_turns:
+            return
+
+        cut = len(self.turns) - 2 * self.keep_turns
+        if self.turns[cut]["role"] == "model":
+            cut += 1  # the kept turns must still open with the child
+        self.folded.extend(self.turns[:cut])
+        self.turns = self.turns[cut:]
+        if not self.summarizing:
+            self.summarizing = True
+            _summary_pool.submit(self._summarize)
+
+    def _summarize(self):
+        while True:
+            with self.lock:
+                old, self.folded = self.folded, []
+                if not old:
+                    self.summarizing = False
+                    return
+                summary = self.summary
+
+            transcript = "\n".join(
+                f"{'Child' if turn['role'] == 'user' else 'Buddy'}: {' '.join(turn['parts'])}" for turn in old
+            )
+            prompt = (
+                "Summarize this conversation between a child and their friend Buddy in at most 80 words. "
+                "Keep names, interests, feelings and anything Buddy promised.\n\n"
+                f"Earlier summary: {summary or 'none'}\n\n{transcript}"
+            )
+            try:
+                summary = self.summary_model.generate_content(prompt).text.strip()
+            except Exception as e:
+                # Dropping the old turns still keeps the prompt bounded
+                print(f"Conversation summary error: {e}")
+                continue
+            with self.lock:
+                self.summary = summary
+
+
+class ConversationManager:
+    """
+    Keeps a bounded LRU of ConversationEngines, one per user, all sharing the
+    same model objects.
+    """
+
+    def __init__(self, model, instructions_for, max_users=256, **engine_options):
+        self.model = model
+        self.instructions_for = instructions_for
+        self.max_users = max_users
+        self.engine_options = engine_options
+        self.engines = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_name, history=None):
+        with self.lock:
+            engine = self.engines.get(user_name)
+            if engine is not None:
+                self.engines.move_to_end(user_name)
+                return engine
+
+            engine = ConversationEngine(self.model, self.instructions_for(user_name), **self.engine_options)
+            if history:
+                engine.seed(history)
+            self.engines[user_name] = engine
+            while len(self.engines) > self.max_users:
+                self.engines.popitem(last=False)
+            return engine
@@ -5,34 +5,226 @@ import speech_recognition as sr
 import pyttsx3
 import os
 from pathlib import Path
-import json
 import queue
 import threading
 import pyaudio
-import wave
 from datetime import datetime
 from dotenv import load_dotenv
 import random
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from sentences import split_sentences
+from vad import Endpointer
+from conversation import ConversationManager
+from profile_store import ProfileStore
+from keyword_matcher import buddy_matcher
+from audio_post import postprocess_file
+from safety import SafetyFilter
+from prompt_cache import PrefixCachedModel
 
 # Load environment variables
 load_dotenv()
 
-class VoiceHandler:
-    def __init__(self):
-        self.recognizer = sr.Recognizer()
-        self.engine = pyttsx3.init()
-        self.setup_voice()
-        self.is_listening = False
-        self.audio_queue = queue.Queue()
+genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
+# BUDDY_GEMINI_MODEL must take a system instruction for the prompt cache
+GEMINI_MODEL = os.getenv("BUDDY_GEMINI_MODEL", "gemini-1.5-flash")
+gemini_model = genai.GenerativeModel(GEMINI_MODEL)
+
+# Buddy's persona and story guidelines never change, so they go to Gemini once
+# (cached context or system instruction) rather than with every message; set
+# BUDDY_PROMPT_CACHE to "cached", "system", "inline", "local" or "auto"
+BUDDY_PROMPT = """
+You are Buddy, a loving and playful bear friend for a child. Remember:
+
+Conversation Style:
+- Use warm, friendly language with occasional fun sound effects
+- Express excitement about their interests
+- Ask engaging questions that encourage imagination
+- Include gentle learning moments when natural
+- Use emojis and expressive language
+- Keep responses playful and age-appropriate
+- If they seem upset or worried, be extra gentle and supportive
+- Share simple, fun facts related to their interests
+- Use varied expressions like "Wow!", "That's amazing!", "How cool!", "Let's imagine..."
+
+Respond as their friendly bear buddy, making the conversation fun and naturally educational!
+
+When asked for a story, be a wonderful storyteller and follow these story guidelines:
+- Keep the story length to about 3-4 short paragraphs
+- Use simple, child-friendly language
+- Include gentle learning moments or moral lessons
+- Make it interactive by occasionally asking the child what they think might happen next
+- Use expressive language and sound effects when appropriate
+- Include dialogue between characters
+- End with a positive message
+- Tell the story in an engaging, warm voice, as if speaking directly to the child
+"""
+chat_model = PrefixCachedModel(
+    GEMINI_MODEL, BUDDY_PROMPT, name="digipet", mode=os.getenv("BUDDY_PROMPT_CACHE", "auto"),
+    cache_model=os.getenv("BUDDY_PROMPT_CACHE_MODEL")
+)
+
+# Older turns are summarized once a conversation grows past this many tokens
+TOKEN_BUDGET = int(os.getenv("BUDDY_TOKEN_BUDGET", "1500"))
+
+# Child profiles survive restarts in this SQLite database
+PROFILE_DB = os.getenv("BUDDY_PROFILE_DB", "profiles.db")
+
+# Stream audio sentence by sentence instead of waiting for the full response
+STREAMING_AUDIO = os.getenv("BUDDY_STREAMING_AUDIO", "1") == "1"
+
+# Recognition runs on a pool of workers fed by a bounded phrase queue; when the
+# queue is full the oldest phrase is dropped
+RECOGNITION_WORKERS = int(os.getenv("BUDDY_RECOGNITION_WORKERS", "2"))
+PHRASE_QUEUE_SIZE = int(os.getenv("BUDDY_PHRASE_QUEUE_SIZE", "8"))
+
+# Microphone capture and voice-activity endpointing
+MIC_SAMPLE_RATE = 16000
+MIC_BLOCK_SIZE = 640  # 40 ms per read
+VAD_HANGOVER_MS = int(os.getenv("BUDDY_VAD_HANGOVER_MS", "300"))
+VAD_MARGIN_DB = float(os.getenv("BUDDY_VAD_MARGIN_DB", "10"))
+
+# Online TTS is skipped for a while after repeated failures instead of waiting
+# for another network timeout on every reply
+ONLINE_TTS_TIMEOUT = float(os.getenv("BUDDY_ONLINE_TTS_TIMEOUT", "5"))
+ONLINE_TTS_FAILURES = int(os.getenv("BUDDY_ONLINE_TTS_FAILURES", "2"))
+ONLINE_TTS_COOLDOWN = float(os.getenv("BUDDY_ONLINE_TTS_COOLDOWN", "60"))
+
+# Longest a reply waits for its audio before going on without it
+TTS_RESULT_TIMEOUT = float(os.getenv("BUDDY_TTS_RESULT_TIMEOUT", "30"))
+
+# Offline speech is trimmed of silence and normalized before it is cached;
+# set an output rate to also resample it down
+TARGET_LOUDNESS_DB = float(os.getenv("BUDDY_TARGET_LOUDNESS_DB", "-20"))
+OUTPUT_SAMPLE_RATE = int(os.getenv("BUDDY_OUTPUT_SAMPLE_RATE", "0")) or None
+
+# Kid messages and Buddy's replies are checked locally before any Gemini or
+# TTS call; unsafe turns get a pre-rendered redirect line
+safety = SafetyFilter(os.getenv("BUDDY_SAFETY_BLOCKLIST"))
+
+# Fixed lines, rendered into the TTS cache at startup so they play instantly
+NAME_FIRST = "Please enter your name first!"
+ASK_NAME = "Before we continue, could you tell me your name? Just say 'My name is' and then your name!"
+LLM_UNAVAILABLE = "Oops! My imagination took a little break. Can you say that again?"
+FIXED_PHRASES = [NAME_FIRST, ASK_NAME, LLM_UNAVAILABLE] + safety.redirect_phrases()
+
+
+class TTSService:
+    """
+    Owns the TTS engines and turns text into audio files.
+
+    pyttsx3 is not thread-safe, so its engine lives on one service thread that
+    takes offline jobs from a queue. gTTS calls are network-bound and run on a
+    small pool. Output files are named by a hash of engine and text, so
+    concurrent replies never overwrite each other and repeated lines are served
+    from disk. After ONLINE_TTS_FAILURES failures within ONLINE_TTS_COOLDOWN
+    seconds, jobs go straight to the offline engine until the cooldown passes.
+    """
+
+    def __init__(self, output_dir="responses", online_workers=4):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(exist_ok=True)
+        self.jobs = queue.Queue()
+        self.online_pool = ThreadPoolExecutor(max_workers=online_workers, thread_name_prefix="gtts")
+        self.failures = deque()
+        self.failures_lock = threading.Lock()
+        threading.Thread(target=self._run, name="tts-service", daemon=True).start()
+
+    def submit(self, text):
+        future = Future()
+        online_path = self._output_path("gtts", text, ".mp3")
+        offline_path = self._output_path("pyttsx3", text, ".wav")
+
+        if online_path.exists():
+            future.set_result(str(online_path))
+        elif not self.online_available():
+            if offline_path.exists():
+                future.set_result(str(offline_path))
+            else:
+                self.jobs.put((text, offline_path, future))
+        else:
+            self.online_pool.submit(self._synthesize_online, text, online_path, offline_path, future)
+        return future
+
+    def prerender(self, phrases):
+        """
+        Queues fixed lines so they are already on disk when first needed.
+        """
+        for text in phrases:
+            self.submit(text)
 
-    def setup_voice(self):
-        voices = self.engine.getProperty('voices')
+    def online_available(self):
+        with self.failures_lock:
+            cutoff = time.monotonic() - ONLINE_TTS_COOLDOWN
+            while self.failures and self.failures[0] < cutoff:
+                self.failures.popleft()
+            return len(self.failures) < ONLINE_TTS_FAILURES
+
+    def _output_path(self, engine, text, suffix):
+        digest = hashlib.sha1(f"{engine}:{text}".encode("utf-8")).hexdigest()[:16]
+        return self.output_dir / f"{digest}{suffix}"
+
+    def _synthesize_online(self, text, online_path, offline_path, future):
+        try:
+            tmp_path = online_path.with_suffix(f".{threading.get_ident()}.tmp")
+            tts = gTTS(text=text, lang='en', tld='com', slow=False, timeout=ONLINE_TTS_TIMEOUT)
+            tts.save(str(tmp_path))
+            os.replace(tmp_path, online_path)
+            future.set_result(str(online_path))
+        except Exception as e:
+            print(f"Online TTS failed: {e}")
+            with self.failures_lock:
+                self.failures.append(time.monotonic())
+            self.jobs.put((text, offline_path, future))
+
+    def _run(self):
+        try:
+            engine = pyttsx3.init()
+            self._setup_voice(engine)
+        except Exception as e:
+            print(f"Offline TTS engine failed to start: {e}")
+            # Keep failing queued jobs so no caller waits on them forever
+            while True:
+                _, _, future = self.jobs.get()
+                future.set_exception(e)
+        while True:
+            text, audio_path, future = self.jobs.get()
+            if audio_path.exists():
+                future.set_result(str(audio_path))
+                continue
+            try:
+                tmp_path = audio_path.with_suffix(".tmp.wav")
+                engine.save_to_file(text, str(tmp_path))
+                engine.runAndWait()
+                postprocess_file(str(tmp_path), OUTPUT_SAMPLE_RATE, TARGET_LOUDNESS_DB)
+                os.replace(tmp_path, audio_path)
+                future.set_result(str(audio_path))
+            except Exception as e:
+                print(f"Offline TTS failed: {e}")
+                future.set_result(None)
+
+    @staticmethod
+    def _setup_voice(engine):
+        voices = engine.getProperty('voices')
         for voice in voices:
             if "female" in voice.name.lower():
-                self.engine.setProperty('voice', voice.id)
+                engine.setProperty('voice', voice.id)
                 break
-        self.engine.setProperty('rate', 150)
-        self.engine.setProperty('volume', 0.9)
+        engine.setProperty('rate', 150)
+        engine.setProperty('volume', 0.9)
+
+
+class VoiceHandler:
+    def __init__(self):
+        self.tts = TTSService("responses")
+        self.tts.prerender(FIXED_PHRASES)
+        self.is_listening = False
+        self.audio_queue = queue.Queue(maxsize=PHRASE_QUEUE_SIZE)
+        self.transcripts = queue.Queue()
+        for i in range(RECOGNITION_WORKERS):
+            threading.Thread(target=self._recognize_worker, name=f"recognizer-{i}", daemon=True).start()
 
     def start_listening(self):
         self.is_listening = True
@@ -42,50 +234,103 @@ class VoiceHandler:
         self.is_listening = False
 
     def _listen_continuous(self):
-        mic = sr.Microphone()
-        with mic as source:
-            self.recognizer.adjust_for_ambient_noise(source)
+        endpointer = Endpointer(
+            sample_rate=MIC_SAMPLE_RATE,
+            hangover_ms=VAD_HANGOVER_MS,
+            margin_db=VAD_MARGIN_DB,
+            max_phrase_seconds=10
+        )
+        pa = pyaudio.PyAudio()
+        stream = pa.open(
+            format=pyaudio.paInt16, channels=1, rate=MIC_SAMPLE_RATE,
+            input=True, frames_per_buffer=MIC_BLOCK_SIZE
+        )
+        try:
             while self.is_listening:
                 try:
-                    audio = self.recognizer.listen(source, timeout=1, phrase_time_limit=10)
-                    self.audio_queue.put(audio)
-                except sr.WaitTimeoutError:
-                    continue
+                    pcm = stream.read(MIC_BLOCK_SIZE, exception_on_overflow=False)
+                    for phrase in endpointer.process(pcm):
+                        self._enqueue_phrase(sr.AudioData(phrase, MIC_SAMPLE_RATE, 2))
                 except Exception as e:
                     print(f"Listening error: {e}")
 
-    def get_last_phrase(self):
-        if not self.audio_queue.empty():
-            audio = self.audio_queue.get()
+            phrase = endpointer.flush()
+            if phrase:
+                self._enqueue_phrase(sr.AudioData(phrase, MIC_SAMPLE_RATE, 2))
+        finally:
+            stream.stop_stream()
+            stream.close()
+            pa.terminate()
+
+    def _enqueue_phrase(self, audio):
+        item = (datetime.now(), audio)
+        while True:
             try:
-                text = self.recognizer.recognize_google(audio)
-                return text
-            except:
-                return None
-        return None
+                self.audio_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.audio_queue.get_nowait()
+                    print("Phrase queue full, dropped the oldest phrase")
+                except queue.Empty:
+                    pass
+
+    def _recognize_worker(self):
+        recognizer = sr.Recognizer()
+        while True:
+            captured_at, audio = self.audio_queue.get()
+            try:
+                text = recognizer.recognize_google(audio)
+            except sr.UnknownValueError:
+                continue
+            except Exception as e:
+                print(f"Recognition error: {e}")
+                continue
+            self.transcripts.put({"text": text, "captured_at": captured_at, "ready_at": datetime.now()})
 
-    def speak(self, text, username="user"):
+    def get_transcript(self):
         try:
-            audio_path = f"responses/{username}_latest.mp3"
-            tts = gTTS(text=text, lang='en', tld='com', slow=False)
-            tts.save(audio_path)
-            return audio_path
+            return self.transcripts.get_nowait()
+        except queue.Empty:
+            return None
+
+    def get_last_phrase(self):
+        transcript = self.get_transcript()
+        return transcript["text"] if transcript else None
+
+    def speak(self, text):
+        return self._audio_for(self.tts.submit(text))
+
+    def speak_stream(self, text):
+        # Fixed lines are cached whole; everything else is queued sentence by
+        # sentence up front so the next one synthesizes while the current one plays
+        sentences = [text] if text in FIXED_PHRASES else split_sentences(text)
+        futures = [self.tts.submit(sentence) for sentence in sentences]
+        for future in futures:
+            audio_path = self._audio_for(future)
+            if audio_path:
+                yield audio_path
+
+    @staticmethod
+    def _audio_for(future):
+        try:
+            return future.result(timeout=TTS_RESULT_TIMEOUT)
         except Exception as e:
-            print(f"Online TTS failed: {e}")
-            try:
-                audio_path = f"responses/{username}_latest.mp3"
-                self.engine.save_to_file(text, audio_path)
-                self.engine.runAndWait()
-                return audio_path
-            except Exception as e:
-                print(f"Offline TTS failed: {e}")
-                return None
+            print(f"TTS error: {e!r}")
+            return None
 
 
 class BuddyAssistant:
     def __init__(self):
         self.voice = VoiceHandler()
-        self.user_contexts = {}
+        self.profiles = ProfileStore(PROFILE_DB)
+        # One Gemini conversation per child, sharing a single model object
+        self.conversations = ConversationManager(
+            chat_model,
+            self._conversation_instructions,
+            summary_model=gemini_model,
+            token_budget=TOKEN_BUDGET
+        )
         self.chat_dir = Path("chat_history")
         self.chat_dir.mkdir(exist_ok=True)
         self.story_themes = {
@@ -100,143 +345,75 @@ class BuddyAssistant:
             os.makedirs("responses")
 
     def process_input(self, user_input, username, history=None):
+        verdict = safety.check(user_input)
+        if not verdict.safe:
+            print(f"Safety prefilter: {verdict.category} input redirected in {verdict.ms:.3f} ms")
+            return safety.redirect(verdict.category)
+
         history = history or []
+        conversation = self.conversations.get(username, history)
 
-        should_tell_story = self._should_generate_story(user_input)
+        # One keyword pass serves story, theme and topic detection
+        matches = buddy_matcher.match(user_input)
+        should_tell_story = self._should_generate_story(matches)
 
         if should_tell_story:
-            context = self._build_story_context(username, user_input, history)
+            note = self._build_story_context(username, matches, history)
         else:
-            context = self._build_conversation_context(username, user_input, history)
+            note = None
+            profile = self._build_conversation_context(username, matches, history)
+            # send() builds its preamble from the profile under this lock
+            with conversation.lock:
+                conversation.profile = profile
 
         try:
-            api_key = os.environ.get('GEMINI_API_KEY')
-            response = genai.GenerativeModel('gemini-pro', api_key=api_key).generate_content(context)
-            return response.text
+            return conversation.send(user_input, note, review=self._review_reply)
         except Exception as e:
             print(f"Gemini API error: {e}")
-            return "Oops! My imagination took a little break. Can you say that again?"
-
-    def _should_generate_story(self, input_text):
-        story_triggers = [
-            'tell me a story',
-            'can you tell a story',
-         'story about',
-         'make up a story',
-            'bedtime story'
-        ]
-        return any(trigger in input_text.lower() for trigger in story_triggers)
-
-    def _build_story_context(self, username, current_input, history):
-        user_context = self.user_contexts.get(username, {
-            'interests': set(),
-            'favorite_themes': [],
-            'interaction_count': 0
-        })
-
-        theme = self._extract_story_theme(current_input, user_context['interests'])
-
-        return f"""
-        You are Buddy, a wonderful storyteller for children. Create an engaging, age-appropriate story based on the following: 
-
-        Child's name: {username}
-        Their interests: {', '.join(user_context['interests'])}
-        Requested theme: {theme}
-
-        Story guidelines:
-        - Keep the story length to about 3-4 short paragraphs
-        - Use simple, child-friendly language
-        - Include gentle learning moments or moral lessons
-        - Make it interactive by occasionally asking the child what they think might happen next
-        - Use expressive language and sound effects when appropriate
-        - Include dialogue between characters
-        - End with a positive message
-
-        Current request: {current_input}
-
-        Tell the story in an engaging, warm voice, as if speaking directly to {username}.
-        """
-
-    def _build_conversation_context(self, username, current_input, history):
-        user_context = self.user_contexts.get(username, {
-            'interests': set(),
-            'favorite_themes': [],
-            'interaction_count': 0,
-            'learning_moments': []
-        })
+            return LLM_UNAVAILABLE
 
-        self._update_user_context(username, current_input, user_context)
+    def _review_reply(self, reply):
+        verdict = safety.check(reply, stage="output")
+        if verdict.safe:
+            return reply
+        print(f"Safety prefilter: {verdict.category} reply replaced")
+        return safety.redirect()
 
-        recent_history = history[-5:] if history else []
-        history_text = "\n".join([
-            f"{'Child' if msg['role'] == 'user' else 'Buddy'}: {msg['content']}"
-            for msg in recent_history
-        ])
+    def _should_generate_story(self, matches):
+        return matches.has('story_trigger')
 
-        return f"""
-        You are Buddy, a loving and playful friend for {username}! Remember:
+    def _build_story_context(self, username, matches, history):
+        profile = self.profiles.record_interaction(username, self._detect_topics(matches))
 
-        Child's Profile:
-        - Name: {username}
-        - Interests: {', '.join(user_context['interests'])}
-        - Previous topics we enjoyed: {', '.join(user_context['favorite_themes'])}
-        - Times we've talked: {user_context['interaction_count']}
+        theme = self._extract_story_theme(matches, profile.interest_names)
 
-        Conversation Style:
-        - Use warm, friendly language with occasional fun sound effects
-        - Express excitement about their interests
-        - Ask engaging questions that encourage imagination
-        - Include gentle learning moments when natural
-        - Use emojis and expressive language
-        - Keep responses playful and age-appropriate
-        - If they seem upset or worried, be extra gentle and supportive
-        - Share simple, fun facts related to their interests
-        - Use varied expressions like "Wow!", "That's amazing!", "How cool!", "Let's imagine..."
+        return (
+            f"Now tell {username} a story, following the story guidelines.\n"
+            f"Their interests: {', '.join(profile.interest_names)}\n"
+            f"Requested theme: {theme}"
+        )
 
-        Recent conversation:
-        {history_text}
+    def _build_conversation_context(self, username, matches, history):
+        profile = self.profiles.record_interaction(username, self._detect_topics(matches))
 
-        Current input: {current_input}
+        return "\n".join([
+            "Child's Profile:",
+            f"- Interests: {', '.join(profile.interest_names)}",
+            f"- Previous topics we enjoyed: {', '.join(profile.favorite_themes)}",
+            f"- Times we've talked: {profile.interaction_count}"
+        ])
 
-        Respond as their friendly bear buddy, making the conversation fun and naturally educational!
-        """
+    def _conversation_instructions(self, username):
+        return f"You're talking with {username}."
 
-    def _extract_story_theme(self, input_text, interests):
-        story_triggers = [
-            'animals',
-            'adventure',
-            'nature',
-            'friendship',
-            'learning'
-        ]
-        for theme in story_triggers:
-            if theme in input_text.lower():
-                return random.choice(self.story_themes[theme])
+    def _extract_story_theme(self, matches, interests):
+        themes = matches.categories('story_theme')
+        if themes:
+            return random.choice(self.story_themes[themes[0]])
         return random.choice(['a friendly bear cub learning something new','magical forest adventures','space exploration with star friends', 'underwater discoveries'])
 
-    def _update_user_context(self, username, input_text, context):
-        context['interaction_count'] += 1
-
-        topics = {
-            'animals': ['dog', 'cat', 'pet', 'animal', 'bird', 'fish', 'zoo'],
-            'nature': ['tree', 'flower', 'outside', 'park', 'garden','sky'],
-            'imagination': ['magic', 'fairy', 'dragon', 'unicorn', 'princess','superhero'],
-            'activities': ['play', 'game', 'draw', 'paint','sing', 'dance', 'run'],
-            'learning': ['school','read', 'book', 'learn','study', 'homework'],
-            'feelings': ['happy','sad', 'angry','scared', 'excited', 'love'],
-            'family': ['mom', 'dad','sister', 'brother', 'grandma', 'grandpa'],
-            'food': ['pizza', 'ice cream', 'candy', 'chocolate', 'cookies'],
-            'colors': ['red', 'blue', 'green', 'yellow', 'purple', 'pink'],
-            'numbers': ['count','math', 'number', 'plus','minus']
-        }
-        for topic, keywords in topics.items():
-            if any(keyword in input_text.lower() for keyword in keywords):
-                context['interests'].add(topic)
-                if topic not in context['favorite_themes']:
-                    context['favorite_themes'].insert(0, topic)
-                    context['favorite_themes'] = context['favorite_themes'][:5]
-
-        self.user_contexts[username] = context
+    def _detect_topics(self, matches):
+        return matches.categories('topic')
 
 
 class VoiceInterface:
@@ -272,7 +449,9 @@ class VoiceInterface:
                         placeholder="Type something fun..."
                     )
 
-            audio_output = gr.Audio(label="Listen to Buddy! 🔊")
+            audio_output = gr.Audio(
+                label="Listen to Buddy! 🔊", streaming=STREAMING_AUDIO, autoplay=STREAMING_AUDIO
+            )
 
             def start_voice():
                 self.buddy.voice.start_listening()
@@ -289,15 +468,15 @@ class VoiceInterface:
                         name = text.lower().split("my name is")[-1].strip()
                         self.current_username = name
                         response = self.buddy.process_input(text, name)
-                        audio_path = self.buddy.voice.speak(response, name)
+                        audio_path = self.buddy.voice.speak(response)
                         return [{"role": "user", "content": text}, {"role": "assistant", "content": response}], audio_path
 
                     if self.current_username:
                         response = self.buddy.process_input(text, self.current_username)
-                        audio_path = self.buddy.voice.speak(response, self.current_username)
+                        audio_path = self.buddy.voice.speak(response)
                         return [{"role": "user", "content": text}, {"role": "assistant", "content": response}], audio_path
                     else:
-                        response = "Before we continue, could you tell me your name? Just say 'My name is' and then your name!"
+                        response = ASK_NAME
                         audio_path = self.buddy.voice.speak(response)
                         return [{"role": "assistant", "content": response}], audio_path
 
@@ -305,14 +484,29 @@ class VoiceInterface:
 
             def process_text(text, username_value, chatbot_state):
                 if not username_value:
-                    response = "Please enter your name first!"
-                    return chatbot_state + [{"role": "assistant", "content": response}], None
+                    response = NAME_FIRST
+                    return chatbot_state + [{"role": "assistant", "content": response}], self.buddy.voice.speak(response)
 
                 self.current_username = username_value
                 response = self.buddy.process_input(text, username_value)
-                audio_path = self.buddy.voice.speak(response, username_value)
+                audio_path = self.buddy.voice.speak(response)
                 return chatbot_state + [{"role": "user", "content": text}, {"role": "assistant", "content": response}], audio_path
 
+            def process_text_stream(text, username_value, chatbot_state):
+                if not username_value:
+                    response = NAME_FIRST
+                    yield chatbot_state + [{"role": "assistant", "content": response}], self.buddy.voice.speak(response)
+                    return
+
+                self.current_username = username_value
+                response = self.buddy.process_input(text, username_value)
+                chatbot_state = chatbot_state + [{"role": "user", "content": text}, {"role": "assistant", "content": response}]
+
+                # Show the text right away, then stream audio sentence by sentence
+                yield chatbot_state, None
+                for audio_path in self.buddy.voice.speak_stream(response):
+                    yield chatbot_state, audio_path
+
             voice_button.click(
                 start_voice,
                 outputs=[voice_button, stop_button]
@@ -324,7 +518,7 @@ class VoiceInterface:
             )
 
             text_input.submit(
-                process_text,
+                process_text_stream if STREAMING_AUDIO else process_text,
                 inputs=[text_input, username, chatbot],
                 outputs=[chatbot, audio_output]
             )
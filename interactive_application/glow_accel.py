@@ -0,0 +1,247 @@
+"""
+Exported CPU inference for the Glow-TTS fallback.
+
+Most of Glow-TTS synthesis time on CPU goes to the MelGAN vocoder, a plain
+convolution stack that exports cleanly. GlowAccelerator exports it once to
+TorchScript (frozen and optimized for inference) or ONNX Runtime (full graph
+optimizations, optionally int8 dynamic quantization), caches the export on
+disk, and swaps it in for the eager vocoder behind Coqui's Synthesizer. The
+Glow-TTS acoustic model itself has data-dependent control flow, so it stays
+eager but runs under inference_mode (plus dynamic int8 Linear layers when
+quantizing, ONNX only).
+
+The swap is checked end to end: a sentence is synthesized with the eager
+models, then again with everything swapped in (quantization included), and
+the eager models are put back if the audio drifts too far from the eager
+output.
+
+    python glow_accel.py --backend onnx --quantize --threads 4
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+GLOW_MODEL = "tts_models/en/ljspeech/glow-tts"
+PARITY_TEXT = "Wow, that sounds like a wonderful adventure! Tell me more about it."
+
+
+class _VocoderInference(torch.nn.Module):
+    def __init__(self, vocoder):
+        super().__init__()
+        self.vocoder = vocoder
+
+    def forward(self, mel):
+        return self.vocoder.inference(mel)
+
+
+class TorchScriptVocoder:
+    def __init__(self, module):
+        self.module = module
+
+    def inference(self, mel):
+        with torch.inference_mode():
+            return self.module(mel.cpu())
+
+
+class OnnxVocoder:
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def inference(self, mel):
+        audio = self.session.run(None, {self.input_name: mel.detach().cpu().numpy().astype(np.float32)})[0]
+        return torch.from_numpy(audio)
+
+
+def snr_db(reference, candidate):
+    n = min(len(reference), len(candidate))
+    reference, candidate = reference[:n], candidate[:n]
+    noise = np.sum(np.square(reference - candidate))
+    return float(10 * np.log10(np.sum(np.square(reference)) / max(noise, 1e-12)))
+
+
+class GlowAccelerator:
+    """
+    Swaps an exported vocoder into a loaded Coqui TTS object. Callers should
+    run synthesis under torch.inference_mode() so the eager acoustic model
+    skips autograd bookkeeping too.
+
+    `backend` is "torchscript" or "onnx"; `threads` sets intra-op threads;
+    `quantize` uses int8 dynamic quantization and needs the ONNX backend.
+    Exports are cached in `cache_dir`.
+
+    For TorchScript, `threads` goes through torch.set_num_threads, which is
+    process-wide: it also changes Bark, Whisper and anything else running on
+    torch in the same process.
+    """
+
+    def __init__(self, tts, backend="onnx", threads=0, quantize=False, cache_dir="glow_export",
+                 min_snr_db=None):
+        self.tts = tts
+        self.synthesizer = tts.synthesizer
+        self.backend = backend
+        self.threads = threads
+        self.quantize = quantize
+        self.cache_dir = Path(cache_dir)
+        # int8 weights cost some fidelity; fp32 exports should match eager closely
+        self.min_snr_db = min_snr_db if min_snr_db is not None else (25 if quantize else 40)
+        self.eager_vocoder = self.synthesizer.vocoder_model
+        self.eager_tts_model = self.synthesizer.tts_model
+        self.accelerated = None
+
+    def install(self, text=PARITY_TEXT):
+        """
+        Exports, swaps the vocoder (and int8 acoustic model) in and checks
+        parity end to end on `text`. Returns the parity report; on failure
+        the eager models are left in place.
+        """
+        if self.eager_vocoder is None:
+            print("Glow-TTS accelerator: model has no separate vocoder, nothing to export")
+            return None
+        if self.quantize and self.backend != "onnx":
+            # Dynamic quantization has no TorchScript conv kernels
+            print("Glow-TTS accelerator: int8 quantization needs the onnx backend, staying on eager PyTorch")
+            return None
+        try:
+            eager_ms, reference = self._synthesize(text)
+            self.accelerated = self._load()
+            self._swap_in()
+            report = self.check_parity(reference, eager_ms, text)
+        except Exception as e:
+            self._restore()
+            print(f"Glow-TTS accelerator error, staying on eager PyTorch: {e}")
+            return None
+
+        print(
+            f"Glow-TTS {self.backend}{' int8' if self.quantize else ''}: "
+            f"SNR {report['snr_db']:.1f} dB vs eager, {report['speedup']:.1f}x faster end to end"
+        )
+        if report["eager_samples"] != report["accelerated_samples"]:
+            # Different phoneme durations; the SNR of misaligned audio means nothing
+            self._restore()
+            print("Glow-TTS accelerator: output length differs from eager, staying on eager PyTorch")
+        elif report["snr_db"] < self.min_snr_db:
+            self._restore()
+            print(f"Glow-TTS accelerator: SNR below {self.min_snr_db} dB, staying on eager PyTorch")
+        return report
+
+    def check_parity(self, reference, eager_ms, text=PARITY_TEXT):
+        """
+        Synthesizes `text` with the current models and compares the audio
+        with `reference`, the eager output for the same text: SNR, largest
+        sample difference, lengths and timings.
+        """
+        accelerated_ms, candidate = self._synthesize(text)
+        n = min(len(reference), len(candidate))
+        return {
+            "snr_db": snr_db(reference, candidate),
+            "max_abs_diff": float(np.max(np.abs(reference[:n] - candidate[:n]))),
+            "eager_samples": len(reference),
+            "accelerated_samples": len(candidate),
+            "audio_s": len(reference) / self.synthesizer.output_sample_rate,
+            "eager_ms": eager_ms,
+            "accelerated_ms": accelerated_ms,
+            "speedup": eager_ms / max(accelerated_ms, 1e-6)
+        }
+
+    def _synthesize(self, text, repeats=3):
+        # Seeded so any sampling noise in the acoustic model is the same every run
+        with torch.inference_mode():
+            self.tts.tts(text=text)  # warm-up
+            start = time.perf_counter()
+            for _ in range(repeats):
+                torch.manual_seed(0)
+                audio = self.tts.tts(text=text)
+        return (time.perf_counter() - start) * 1000 / repeats, np.asarray(audio, dtype=np.float32).reshape(-1)
+
+    def _swap_in(self):
+        self.synthesizer.vocoder_model = self.accelerated
+        if self.quantize:
+            self.synthesizer.tts_model = torch.ao.quantization.quantize_dynamic(
+                self.eager_tts_model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+    def _restore(self):
+        self.synthesizer.vocoder_model = self.eager_vocoder
+        self.synthesizer.tts_model = self.eager_tts_model
+
+    def _load(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        mel = torch.randn(1, self._mel_channels(), 200)
+        module = _VocoderInference(self.eager_vocoder.cpu()).eval()
+
+        if self.backend == "torchscript":
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            path = self.cache_dir / "vocoder.ts.pt"
+            if not path.exists():
+                with torch.no_grad():
+                    traced = torch.jit.trace(module, mel, check_trace=False)
+                torch.jit.save(traced, str(path))
+            scripted = torch.jit.load(str(path)).eval()
+            return TorchScriptVocoder(torch.jit.optimize_for_inference(torch.jit.freeze(scripted)))
+
+        if self.backend == "onnx":
+            import onnxruntime as ort
+
+            path = self.cache_dir / "vocoder.onnx"
+            if not path.exists():
+                with torch.no_grad():
+                    torch.onnx.export(
+                        module, mel, str(path), input_names=["mel"], output_names=["audio"],
+                        dynamic_axes={"mel": {0: "batch", 2: "frames"}, "audio": {0: "batch", 2: "samples"}},
+                        opset_version=17
+                    )
+            if self.quantize:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantized = self.cache_dir / "vocoder.int8.onnx"
+                if not quantized.exists():
+                    quantize_dynamic(str(path), str(quantized), weight_type=QuantType.QInt8)
+                path = quantized
+
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.optimized_model_filepath = str(path.with_suffix(".opt.onnx"))
+            if self.threads:
+                options.intra_op_num_threads = self.threads
+                options.inter_op_num_threads = 1
+            session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+            return OnnxVocoder(session)
+
+        raise ValueError(f"Unknown Glow-TTS backend: {self.backend}")
+
+    def _mel_channels(self):
+        config = getattr(self.synthesizer, "vocoder_config", None)
+        return config.audio["num_mels"] if config is not None else 80
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and benchmark the Glow-TTS vocoder")
+    parser.add_argument("--backend", default="onnx", choices=["torchscript", "onnx"])
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--cache-dir", default="glow_export")
+    parser.add_argument("--text", default=PARITY_TEXT)
+    args = parser.parse_args()
+
+    from TTS.api import TTS
+    tts = TTS(GLOW_MODEL).to("cpu")
+
+    accelerator = GlowAccelerator(tts, args.backend, args.threads, args.quantize, args.cache_dir)
+    report = accelerator.install(args.text)
+    if report is None:
+        return
+
+    print(f"Parity: {report}")
+    print(
+        f"End to end: eager {report['eager_ms']:.0f} ms (RTF {report['eager_ms'] / 1000 / report['audio_s']:.3f}), "
+        f"{args.backend} {report['accelerated_ms']:.0f} ms (RTF {report['accelerated_ms'] / 1000 / report['audio_s']:.3f})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+
+class ChatHistoryStore:
+    """
+    Append-only chat history, one JSONL file per user.
+
+    Every turn is written as a single line ({"ts": ..., "messages": [...]}),
+    so saving is O(turn) instead of O(history) and a crash can at worst leave
+    one torn line at the end, which readers skip. Reads only look at the tail
+    of the file. Files are compacted every `compact_every` appends, keeping the
+    newest `max_records` turns, and legacy `<name>_chat.json` files are
+    imported the first time a user is seen.
+    """
+
+    def __init__(self, directory, compact_every=200, max_records=2000, block_size=8192):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+        self.compact_every = compact_every
+        self.max_records = max_records
+        self.block_size = block_size
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._appends = {}
+
+    def path(self, user_name):
+        return self.directory / f"{user_name}_chat.jsonl"
+
+    def legacy_path(self, user_name):
+        return self.directory / f"{user_name}_chat.json"
+
+    def _lock(self, user_name):
+        with self._locks_guard:
+            return self._locks.setdefault(user_name, threading.Lock())
+
+    def append(self, user_name, messages):
+        self.append_many(user_name, [messages])
+
+    def append_many(self, user_name, turns):
+        if not user_name or not turns:
+            return
+        lines = "".join(
+            json.dumps({"ts": datetime.now().isoformat(), "messages": messages}) + "\n"
+            for messages in turns
+        )
+        with self._lock(user_name):
+            self._import_legacy(user_name)
+            path = self.path(user_name)
+            if self._has_torn_tail(path):
+                # Start on a fresh line so a half-written record from a crash
+                # doesn't swallow this one
+                lines = "\n" + lines
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._appends[user_name] = self._appends.get(user_name, 0) + len(turns)
+            if self._appends[user_name] >= self.compact_every:
+                self._compact(user_name)
+
+    def tail(self, user_name, n_messages):
+        """
+        Returns the last `n_messages` messages without parsing the whole log.
+        """
+        if not user_name or n_messages <= 0:
+            return []
+        with self._lock(user_name):
+            self._import_legacy(user_name)
+            path = self.path(user_name)
+            if not path.exists():
+                return []
+
+            messages = []
+            for line in self._read_lines_reversed(path):
+                record = self._parse(line)
+                if record is None:
+                    continue
+                messages[:0] = record["messages"]
+                if len(messages) >= n_messages:
+                    break
+            return messages[-n_messages:]
+
+    def compact(self, user_name):
+        with self._lock(user_name):
+            self._compact(user_name)
+
+    def _compact(self, user_name):
+        path = self.path(user_name)
+        self._appends[user_name] = 0
+        if not path.exists():
+            return
+        with open(path, encoding="utf-8") as f:
+            records = [record for record in map(self._parse, f) if record is not None]
+        self._write_atomic(path, records[-self.max_records:])
+
+    def _import_legacy(self, user_name):
+        path = self.path(user_name)
+        legacy = self.legacy_path(user_name)
+        if path.exists() or not legacy.exists():
+            return
+        try:
+            with open(legacy, encoding="utf-8") as f:
+                history = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not import legacy history {legacy}: {e}")
+            return
+
+        # Group the flat message list into turns: a user message starts a new
+        # record, assistant messages join the current one
+        ts = datetime.fromtimestamp(legacy.stat().st_mtime).isoformat()
+        records = []
+        for msg in history:
+            if msg.get("role") == "user" or not records:
+                records.append({"ts": ts, "messages": []})
+            records[-1]["messages"].append(msg)
+        self._write_atomic(path, records)
+
+    @staticmethod
+    def _has_torn_tail(path):
+        if not path.exists() or path.stat().st_size == 0:
+            return False
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    @staticmethod
+    def _write_atomic(path, records):
+        tmp_path = path.with_suffix(".jsonl.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _parse(line):
+        line = line.strip() if isinstance(line, str) else line.decode("utf-8", "replace").strip()
+        if not line:
+            return None
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # A torn write from a crash; skip it
+            return None
+        if not isinstance(record, dict) or not isinstance(record.get("messages"), list):
+            return None
+        return record
+
+    def _read_lines_reversed(self, path):
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            remainder = b""
+            while position > 0:
+                read_size = min(self.block_size, position)
+                position -= read_size
+                f.seek(position)
+                block = f.read(read_size) + remainder
+                lines = block.split(b"\n")
+                # The first piece may be the end of a line that started in an
+                # earlier block, so carry it over
+                remainder = lines.pop(0)
+                for line in reversed(lines):
+                    if line:
+                        yield line
+            if remainder:
+                yield remainder
@@ -0,0 +1,178 @@
+import re
+from collections import Counter, namedtuple
+
+# `start` is the index of the word the keyword starts at
+Hit = namedtuple("Hit", ["group", "category", "keyword", "weight", "start"])
+
+# Words, and each other non-space character (punctuation, emoji) on its own
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+# Builds a Hit without namedtuple's keyword-argument handling
+_new_hit = tuple.__new__
+
+
+class Matches:
+    """
+    All keyword hits found in one text, with helpers to query them by group.
+    """
+
+    def __init__(self, hits, order):
+        self.hits = hits
+        self._order = order
+
+    def scores(self, group):
+        scores = Counter()
+        for hit in self.hits:
+            if hit.group == group:
+                scores[hit.category] += hit.weight
+        return scores
+
+    def categories(self, group):
+        """
+        Categories of `group` that matched, in the order they were declared.
+        """
+        found = {hit.category for hit in self.hits if hit.group == group}
+        return [category for category in self._order[group] if category in found]
+
+    def best(self, group, default=None):
+        """
+        Highest-scoring category of `group`; ties go to the one declared first.
+        """
+        scores = self.scores(group)
+        if not scores:
+            return default
+        return max(self._order[group], key=lambda category: scores.get(category, 0))
+
+    def has(self, group, category=None):
+        return any(hit.group == group and (category is None or hit.category == category) for hit in self.hits)
+
+
+class KeywordMatcher:
+    """
+    Finds every keyword of every category in a single pass over the text's
+    words.
+
+    `groups` maps a group name (e.g. "emotion") to categories, and each
+    category to a list of keywords or a {keyword: weight} dict. Keywords
+    match whole words only, so "scary" no longer counts as "car" and
+    "hotdog" not as "dog"; simple inflections of a keyword's last word
+    ("dogs", "singing", "stories") still match. Every inflected form is
+    expanded into a dict up front, so matching is one lookup per word, plus
+    a check of the next few words for multi-word keywords.
+    """
+
+    def __init__(self, groups):
+        self._targets = {}
+        self._order = {}
+        for group, categories in groups.items():
+            self._order[group] = list(categories)
+            for category, keywords in categories.items():
+                if not isinstance(keywords, dict):
+                    keywords = dict.fromkeys(keywords, 1)
+                for keyword, weight in keywords.items():
+                    key = self._normalize(keyword)
+                    self._targets.setdefault(key, []).append((group, category, weight))
+
+        self._hit_fields = {
+            key: [(group, category, key, weight) for group, category, weight in targets]
+            for key, targets in self._targets.items()
+        }
+
+        # First word (any form, for one-word keywords) -> [(middle words, last word forms, key)]
+        self._index = {}
+        for key in self._targets:
+            words = _TOKEN.findall(key)
+            forms = self._inflections(words[-1])
+            if len(words) == 1:
+                for form in forms:
+                    self._index.setdefault(form, []).append(((), None, key))
+            else:
+                self._index.setdefault(words[0], []).append((tuple(words[1:-1]), forms, key))
+
+    @staticmethod
+    def _inflections(word):
+        if not word[-1].isalpha():
+            return {word}
+        # Simple inflections: dog -> dogs, sing -> singing, story -> stories
+        if word[-1] == "y":
+            return {word[:-1] + suffix for suffix in ("y", "ys", "ying", "yed", "ies", "ied")}
+        return {word + suffix for suffix in ("", "s", "es", "ing", "ed")}
+
+    @staticmethod
+    def _normalize(keyword):
+        return " ".join(keyword.lower().split())
+
+    def match(self, text):
+        words = _TOKEN.findall((text or "").lower())
+        index = self._index
+        found = []
+        for i, word in enumerate(words):
+            candidates = index.get(word)
+            if not candidates:
+                continue
+            for middle, last_forms, key in candidates:
+                if last_forms is not None:
+                    end = i + len(middle) + 1
+                    if end >= len(words) or words[end] not in last_forms:
+                        continue
+                    if middle and tuple(words[i + 1:end]) != middle:
+                        continue
+                found.append((key, i))
+
+        hits = [_new_hit(Hit, fields + (i,)) for key, i in found for fields in self._hit_fields[key]]
+        return Matches(hits, self._order)
+
+    def match_many(self, texts):
+        return [self.match(text) for text in texts]
+
+    def count_many(self, texts, group=None):
+        """
+        Tallies categories over many texts (e.g. a whole chat history), counting
+        each category at most once per text.
+        """
+        counts = Counter()
+        for text in texts:
+            seen = {(hit.group, hit.category) for hit in self.match(text).hits}
+            counts.update(
+                f"{g}:{c}" if group is None else c for g, c in seen if group is None or g == group
+            )
+        return counts
+
+
+EMOTION_KEYWORDS = {
+    "happy": ["yay", "wonderful", "happy", "joy", "excited", "great"],
+    "sad": ["sad", "sorry", "unfortunate", "miss", "difficult"],
+    "excited": ["wow", "amazing", "awesome", "incredible", "fantastic"],
+    "calm": ["gentle", "peaceful", "quiet", "soft"],
+    "singing": ["🎵", "sing", "song", "la la", "tune"],
+    "storytelling": {"once upon a time": 3, "story": 1, "tale": 1, "chapter": 1}
+}
+
+TOPIC_KEYWORDS = {
+    'animals': ['dog', 'cat', 'pet', 'animal', 'bird', 'fish', 'zoo'],
+    'nature': ['tree', 'flower', 'outside', 'park', 'garden', 'sky'],
+    'imagination': ['magic', 'fairy', 'dragon', 'unicorn', 'princess', 'superhero'],
+    'activities': ['play', 'game', 'draw', 'paint', 'sing', 'dance', 'run'],
+    'learning': ['school', 'read', 'book', 'learn', 'study', 'homework'],
+    'feelings': ['happy', 'sad', 'angry', 'scared', 'excited', 'love'],
+    'family': ['mom', 'dad', 'sister', 'brother', 'grandma', 'grandpa'],
+    'food': ['pizza', 'ice cream', 'candy', 'chocolate', 'cookie'],
+    'colors': ['red', 'blue', 'green', 'yellow', 'purple', 'pink'],
+    'numbers': ['count', 'math', 'number', 'plus', 'minus']
+}
+
+STORY_TRIGGERS = {
+    'story': ['tell me a story', 'can you tell a story', 'story about', 'make up a story', 'bedtime story']
+}
+
+STORY_THEME_KEYWORDS = {
+    theme: [theme] for theme in ['animals', 'adventure', 'nature', 'friendship', 'learning']
+}
+
+# Shared by emotion detection, topic tracking and story detection
+buddy_matcher = KeywordMatcher({
+    "emotion": EMOTION_KEYWORDS,
+    "topic": TOPIC_KEYWORDS,
+    "story_trigger": STORY_TRIGGERS,
+    "story_theme": STORY_THEME_KEYWORDS
+})
@@ -0,0 +1,52 @@
+import io
+import json
+import os
+import urllib.request
+import wave
+
+import numpy as np
+
+
+class ModelClient:
+    """
+    Thin client for model_server.py. Errors are raised so callers can fall
+    through to their next TTS/STT tier as before.
+    """
+
+    def __init__(self, base_url, timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def synthesize(self, engine, text, output_path, voice_preset=None, speed=1.0):
+        payload = json.dumps({
+            "engine": engine, "text": text, "voice_preset": voice_preset, "speed": speed
+        }).encode("utf-8")
+        audio = self._post("/synthesize", payload, {"Content-Type": "application/json"})
+        with open(output_path, "wb") as f:
+            f.write(audio)
+        return output_path
+
+    def transcribe(self, audio_file):
+        with open(audio_file, "rb") as f:
+            audio = f.read()
+        suffix = os.path.splitext(audio_file)[1] or ".wav"
+        response = self._post("/transcribe", audio, {"Content-Type": "application/octet-stream", "X-Audio-Suffix": suffix})
+        return json.loads(response)["text"]
+
+    def transcribe_samples(self, samples, sample_rate):
+        """
+        Transcribes float samples in [-1, 1] by sending them as 16-bit WAV.
+        """
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+        response = self._post("/transcribe", buffer.getvalue(), {"Content-Type": "application/octet-stream", "X-Audio-Suffix": ".wav"})
+        return json.loads(response)["text"]
+
+    def _post(self, path, payload, headers):
+        request = urllib.request.Request(self.base_url + path, data=payload, headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.read()
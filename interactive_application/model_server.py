@@ -0,0 +1,222 @@
+"""
+Local inference daemon that loads Bark, Glow-TTS and Whisper once and serves
+every DigiMate front-end on the machine over localhost HTTP.
+
+    python model_server.py            # listens on 127.0.0.1:8765
+    DIGIMATE_MODEL_SERVER=http://127.0.0.1:8765 python buddy.py
+
+Endpoints:
+    POST /synthesize  JSON {"engine": "bark"|"glow", "text": ..., "voice_preset": ..., "speed": ...}
+                      -> audio/wav
+    POST /transcribe  raw audio file bytes -> JSON {"text": ...}
+    GET  /health      -> JSON request statistics per model
+
+Transcriptions that queue up while Whisper is busy are decoded together as one
+batch (openai-whisper backend; see SpeechToText.transcribe_batch). Synthesis
+is not batched across requests: Bark's generate_audio and Coqui's Synthesizer
+take one text per call, and padding Glow-TTS inputs into a batch would mean
+reimplementing the Synthesizer's text and vocoder pipeline. Identical
+synthesis requests are still computed once.
+"""
+import io
+import json
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import soundfile as sf
+import torch
+from bark import SAMPLE_RATE, generate_audio, preload_models
+from TTS.api import TTS
+
+from glow_accel import GlowAccelerator
+from stt import SpeechToText
+
+HOST = os.getenv("DIGIMATE_MODEL_SERVER_HOST", "127.0.0.1")
+PORT = int(os.getenv("DIGIMATE_MODEL_SERVER_PORT", "8765"))
+GLOW_BACKEND = os.getenv("DIGIMATE_GLOW_BACKEND", "eager")
+# With the torchscript backend this is torch.set_num_threads, which applies to
+# the whole process (Bark and Whisper included), not just Glow-TTS
+GLOW_THREADS = int(os.getenv("DIGIMATE_GLOW_THREADS", "0"))
+GLOW_QUANTIZE = os.getenv("DIGIMATE_GLOW_QUANTIZE", "0") == "1"
+
+
+class ModelWorker:
+    """
+    Runs one model's requests in order on its own thread.
+
+    Requests are not held back to form batches; each runs as soon as the
+    model is free. Any requests that queued up meanwhile are taken together:
+    identical ones among them (same text and options, e.g. several kiosks
+    greeting at once) are computed once and the result is shared, and the
+    rest go to `run_batch` in one call when the model has one.
+    """
+
+    def __init__(self, name, run_one, run_batch=None):
+        self.name = name
+        self.run_one = run_one
+        self.run_batch = run_batch
+        self.requests = queue.Queue()
+        self.stats = {"requests": 0, "computed": 0, "batches": 0}
+        threading.Thread(target=self._run, name=f"model-{name}", daemon=True).start()
+
+    def submit(self, key, *args):
+        future = Future()
+        self.requests.put((key, args, future))
+        return future
+
+    def _collect(self):
+        pending = [self.requests.get()]
+        while True:
+            try:
+                pending.append(self.requests.get_nowait())
+            except queue.Empty:
+                return pending
+
+    def _run(self):
+        while True:
+            groups = {}
+            for key, args, future in self._collect():
+                groups.setdefault(key, (args, []))[1].append(future)
+                self.stats["requests"] += 1
+
+            with torch.inference_mode():
+                if self.run_batch is not None and len(groups) > 1:
+                    self._run_batch(list(groups.values()))
+                    continue
+                for args, futures in groups.values():
+                    self.stats["computed"] += 1
+                    self.stats["batches"] += 1
+                    try:
+                        result = self.run_one(*args)
+                    except Exception as e:
+                        for future in futures:
+                            future.set_exception(e)
+                        continue
+                    for future in futures:
+                        future.set_result(result)
+
+    def _run_batch(self, groups):
+        self.stats["computed"] += len(groups)
+        self.stats["batches"] += 1
+        try:
+            results = self.run_batch([args for args, _ in groups])
+        except Exception as e:
+            for _, futures in groups:
+                for future in futures:
+                    future.set_exception(e)
+            return
+        for (_, futures), result in zip(groups, results):
+            for future in futures:
+                future.set_result(result)
+
+
+def to_wav_bytes(audio, sample_rate):
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sample_rate, format="WAV")
+    return buffer.getvalue()
+
+
+class ModelHost:
+    def __init__(self):
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        preload_models()
+        self.glow = TTS("tts_models/en/ljspeech/glow-tts").to(device)
+        if GLOW_BACKEND != "eager" and device == "cpu":
+            GlowAccelerator(self.glow, GLOW_BACKEND, threads=GLOW_THREADS, quantize=GLOW_QUANTIZE).install()
+        self.stt = SpeechToText(
+            model_size=os.getenv("WHISPER_MODEL", "base"),
+            backend=os.getenv("WHISPER_BACKEND", "faster-whisper"),
+            device=device,
+            compute_type=os.getenv("WHISPER_COMPUTE_TYPE", "int8" if device == "cpu" else "float16")
+        )
+        self.workers = {
+            "bark": ModelWorker("bark", self._bark),
+            "glow": ModelWorker("glow", self._glow),
+            "whisper": ModelWorker("whisper", self._whisper, self._whisper_batch),
+        }
+
+    def synthesize(self, engine, text, voice_preset=None, speed=1.0):
+        key = (text, voice_preset) if engine == "bark" else (text, speed)
+        return self.workers[engine].submit(key, text, voice_preset if engine == "bark" else speed).result()
+
+    def transcribe(self, audio_bytes, suffix=".wav"):
+        return self.workers["whisper"].submit(audio_bytes, audio_bytes, suffix).result()
+
+    def _bark(self, text, voice_preset):
+        return to_wav_bytes(generate_audio(text, history_prompt=voice_preset), SAMPLE_RATE)
+
+    def _glow(self, text, speed):
+        audio = self.glow.tts(text=text, speed=speed)
+        return to_wav_bytes(audio, self.glow.synthesizer.output_sample_rate)
+
+    def _whisper(self, audio_bytes, suffix):
+        with tempfile.NamedTemporaryFile(suffix=suffix) as temp_file:
+            temp_file.write(audio_bytes)
+            temp_file.flush()
+            return self.stt.transcribe_file(temp_file.name)
+
+    def _whisper_batch(self, requests):
+        clips = []
+        for audio_bytes, suffix in requests:
+            with tempfile.NamedTemporaryFile(suffix=suffix) as temp_file:
+                temp_file.write(audio_bytes)
+                temp_file.flush()
+                clips.append(self.stt.load_audio(temp_file.name))
+        return self.stt.transcribe_batch(clips)
+
+
+def make_handler(host):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send(404, b"not found", "text/plain")
+            stats = {name: worker.stats for name, worker in host.workers.items()}
+            self._send(200, json.dumps(stats).encode(), "application/json")
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                if self.path == "/synthesize":
+                    request = json.loads(body)
+                    audio = host.synthesize(
+                        request.get("engine", "bark"),
+                        request["text"],
+                        request.get("voice_preset"),
+                        request.get("speed", 1.0)
+                    )
+                    self._send(200, audio, "audio/wav")
+                elif self.path == "/transcribe":
+                    text = host.transcribe(body, self.headers.get("X-Audio-Suffix", ".wav"))
+                    self._send(200, json.dumps({"text": text}).encode(), "application/json")
+                else:
+                    self._send(404, b"not found", "text/plain")
+            except Exception as e:
+                print(f"Model server error on {self.path}: {e}")
+                self._send(500, str(e).encode(), "text/plain")
+
+        def _send(self, status, payload, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    host = ModelHost()
+    server = ThreadingHTTPServer((HOST, PORT), make_handler(host))
+    print(f"DigiMate model server listening on http://{HOST}:{PORT}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
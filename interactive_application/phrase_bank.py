@@ -0,0 +1,193 @@
+import hashlib
+import json
+import re
+import tempfile
+import threading
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from audio_utils import resample, to_float, to_int16
+
+
+class PhraseBank:
+    """
+    Pre-rendered audio for Buddy's fixed lines, one take per emotion preset.
+
+    All takes live in a single int16 PCM file (`bank.pcm`) at one sample rate,
+    with `index.json` mapping "emotion|text" to offset and length. The PCM
+    file is memory-mapped, so playing a phrase is a slice of the map, not a
+    synthesis call. Templated lines ("Hi {name}! ...") store their fixed
+    prefix and suffix; only the variable part is synthesized live and spliced
+    in between.
+
+    Rendering is incremental and resumable: each take is appended and the
+    index rewritten as soon as it is done, so the bank is usable while it is
+    still being built.
+
+    Players that want a file get one from `path()`, written once per take
+    under `clips/`; spliced clips are written out with `save()`.
+    """
+
+    def __init__(self, directory="phrase_bank", sample_rate=24000, gap_ms=120):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+        self.pcm_path = self.directory / "bank.pcm"
+        self.clips_dir = self.directory / "clips"
+        self.clips_dir.mkdir(exist_ok=True)
+        self.index_path = self.directory / "index.json"
+        self.sample_rate = sample_rate
+        self.gap = np.zeros(int(sample_rate * gap_ms / 1000), dtype=np.int16)
+        self.lock = threading.Lock()
+        self.index = {}
+        self._mmap = None
+        if self.index_path.exists():
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    @staticmethod
+    def key(text, emotion):
+        return f"{emotion}|{' '.join(text.split())}"
+
+    def get(self, text, emotion):
+        """
+        Returns (sample_rate, int16 samples) for a pre-rendered phrase, or None.
+        """
+        entry = self.index.get(self.key(text, emotion))
+        if entry is None:
+            return None
+        return self.sample_rate, self._samples(entry)
+
+    def path(self, text, emotion):
+        """
+        Returns a WAV file path for a pre-rendered phrase, or None.
+        """
+        entry = self.index.get(self.key(text, emotion))
+        if entry is None:
+            return None
+        name = hashlib.sha1(self.key(text, emotion).encode("utf-8")).hexdigest()[:16]
+        path = self.clips_dir / f"{name}_{entry['offset']}.wav"
+        if not path.exists():
+            tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            self._write_wav(tmp_path, self._samples(entry))
+            tmp_path.replace(path)
+        return str(path)
+
+    def save(self, clip):
+        """
+        Writes a (sample_rate, samples) clip, e.g. from `splice()`, to a
+        temporary WAV file and returns its path; None stays None.
+        """
+        if clip is None:
+            return None
+        sample_rate, samples = clip
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+            self._write_wav(temp_file.name, to_int16(samples), sample_rate)
+        return temp_file.name
+
+    def _write_wav(self, path, samples, sample_rate=None):
+        with wave.open(str(path), "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate or self.sample_rate)
+            wav.writeframes(np.ascontiguousarray(samples, dtype=np.int16).tobytes())
+
+    def build(self, phrases, emotions, render):
+        """
+        Renders every phrase for every emotion that is not in the bank yet.
+        `render(text, emotion)` returns (float or int16 samples, sample_rate).
+        """
+        for text in phrases:
+            for emotion in emotions:
+                key = self.key(text, emotion)
+                if key in self.index:
+                    continue
+                try:
+                    audio, sample_rate = render(text, emotion)
+                except Exception as e:
+                    print(f"Phrase bank render error for {key!r}: {e}")
+                    continue
+                self._append(key, audio, sample_rate)
+
+    def build_in_background(self, phrases, emotions, render):
+        threading.Thread(target=self.build, args=(phrases, emotions, render), daemon=True).start()
+
+    def splice(self, *parts):
+        """
+        Joins phrases and live audio into one clip with a short pause between
+        parts. Each part is (sample_rate, samples); None parts are skipped.
+        """
+        clips = []
+        for part in parts:
+            if part is None:
+                continue
+            sample_rate, samples = part
+            samples = to_int16(resample(to_float(samples), sample_rate, self.sample_rate))
+            if clips:
+                clips.append(self.gap)
+            clips.append(samples)
+        if not clips:
+            return None
+        return self.sample_rate, np.concatenate(clips)
+
+    def _samples(self, entry):
+        end = entry["offset"] + entry["length"]
+        if self._mmap is None or len(self._mmap) < end:
+            self._mmap = np.memmap(self.pcm_path, dtype=np.int16, mode="r")
+        return self._mmap[entry["offset"]:end]
+
+    def _append(self, key, audio, sample_rate):
+        samples = to_int16(resample(to_float(audio), sample_rate, self.sample_rate))
+        with self.lock:
+            offset = self.pcm_path.stat().st_size // 2 if self.pcm_path.exists() else 0
+            with open(self.pcm_path, "ab") as f:
+                f.write(samples.tobytes())
+            self.index = {**self.index, key: {"offset": offset, "length": len(samples)}}
+            tmp_path = self.index_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.index, f)
+            tmp_path.replace(self.index_path)
+
+
+class PhraseTemplate:
+    """
+    A line like "Hi {name}! It's great to meet you!" split into a fixed
+    prefix and suffix for the phrase bank and a variable middle.
+    """
+
+    def __init__(self, template, field="name"):
+        self.template = template
+        self.field = field
+        prefix, suffix = template.split("{" + field + "}", 1)
+        # Punctuation right after the field ("{name}!") is voiced with the
+        # name so the suffix starts on a clean word
+        self.joiner = re.match(r"[^\w\s]*", suffix).group()
+        self.prefix = prefix.strip()
+        self.suffix = suffix[len(self.joiner):].strip()
+
+    @property
+    def fixed_parts(self):
+        return [part for part in (self.prefix, self.suffix) if part]
+
+    def format(self, value):
+        return self.template.format(**{self.field: value})
+
+    def render(self, bank, value, emotion, synthesize):
+        """
+        Returns (sample_rate, samples) for the filled-in line, synthesizing only
+        `value` via `synthesize(text, emotion) -> (samples, sample_rate)`.
+        Returns None if the fixed parts are not in the bank yet.
+        """
+        fixed = [bank.get(part, emotion) for part in self.fixed_parts]
+        if any(part is None for part in fixed):
+            return None
+        audio, sample_rate = synthesize(f"{value}{self.joiner}", emotion)
+
+        parts = []
+        if self.prefix:
+            parts.append(fixed.pop(0))
+        parts.append((sample_rate, audio))
+        if self.suffix:
+            parts.append(fixed.pop(0))
+        return bank.splice(*parts)
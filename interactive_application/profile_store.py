@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Fixed topic order; a profile's interests are a bitmask over these indices,
+# so never reorder or remove entries, only append
+TOPICS = [
+    'animals', 'nature', 'imagination', 'activities', 'learning',
+    'feelings', 'family', 'food', 'colors', 'numbers'
+]
+TOPIC_INDEX = {topic: i for i, topic in enumerate(TOPICS)}
+
+
+class UserProfile:
+    """
+    Compact per-child profile: an interest bitmask, a small ring of favorite
+    topic indices (newest first) and the number of interactions.
+    """
+
+    __slots__ = ("interests", "themes", "interaction_count")
+
+    def __init__(self, interests=0, themes=b"", interaction_count=0):
+        self.interests = interests
+        self.themes = themes
+        self.interaction_count = interaction_count
+
+    @property
+    def interest_names(self):
+        return [topic for i, topic in enumerate(TOPICS) if self.interests >> i & 1]
+
+    @property
+    def favorite_themes(self):
+        return [TOPICS[i] for i in self.themes]
+
+    def add_topic(self, topic, max_themes=5):
+        index = TOPIC_INDEX[topic]
+        self.interests |= 1 << index
+        if index not in self.themes:
+            self.themes = (bytes([index]) + self.themes)[:max_themes]
+
+
+class ProfileStore:
+    """
+    Persistent user profiles in SQLite with a bounded in-memory LRU of hot
+    profiles in front of it.
+    """
+
+    def __init__(self, path="profiles.db", max_cached=1024, max_themes=5):
+        self.max_cached = max_cached
+        self.max_themes = max_themes
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            "username TEXT PRIMARY KEY, interests INTEGER NOT NULL, "
+            "themes BLOB NOT NULL, interaction_count INTEGER NOT NULL)"
+        )
+        self.db.commit()
+
+    def get(self, username):
+        with self.lock:
+            return self._get(username)
+
+    def record_interaction(self, username, topics=()):
+        """
+        Counts one interaction, adds any detected topics and persists the profile.
+        """
+        with self.lock:
+            profile = self._get(username)
+            profile.interaction_count += 1
+            for topic in topics:
+                profile.add_topic(topic, self.max_themes)
+            self.db.execute(
+                "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?, ?)",
+                (username, profile.interests, profile.themes, profile.interaction_count)
+            )
+            self.db.commit()
+            return profile
+
+    def _get(self, username):
+        profile = self.cache.get(username)
+        if profile is not None:
+            self.cache.move_to_end(username)
+            return profile
+
+        row = self.db.execute(
+            "SELECT interests, themes, interaction_count FROM profiles WHERE username = ?",
+            (username,)
+        ).fetchone()
+        profile = UserProfile(row[0], bytes(row[1]), row[2]) if row else UserProfile()
+        self.cache[username] = profile
+        while len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+        return profile
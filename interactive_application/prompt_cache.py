@@ -0,0 +1,358 @@
+"""
+Sends a large static prompt prefix once instead of on every Gemini call.
+
+PrefixCachedModel wraps a model name and a static prefix (persona, rules,
+story guidelines) and takes only the dynamic tail of each request. The
+prefix is delivered by the best mechanism that works:
+
+    cached  - a Gemini CachedContent holding the prefix as its system
+              instruction; requests only reference it. Needs a versioned
+              model name (e.g. gemini-1.5-flash-002) and a prefix of at least
+              PROMPT_CACHE_MIN_TOKENS (default 32768, the Gemini 1.5 minimum).
+    system  - the prefix as the model's system_instruction.
+    inline  - the prefix prepended to the first user turn, as before.
+    local   - an offline stand-in model for tests, which reports the prefix
+              as cached tokens when it meets the same minimum.
+
+"auto" tries cached, system and inline in that order and keeps the first
+that answers. PromptStats tracks per-call prompt bytes and tokens against
+what the same call would have cost with the prefix inlined.
+
+The static prefixes in this repo are a few hundred tokens, far below the
+default minimum, so "auto" never reaches the cached mode and before/after
+numbers measure system_instruction alone. Lower PROMPT_CACHE_MIN_TOKENS for
+models that cache smaller prompts.
+
+interactive_application/prompt_cache.py and api/prompt_cache.py are identical
+copies, since the two trees are deployed separately; change both together.
+"""
+import datetime
+import math
+import os
+import threading
+from collections import Counter, deque
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+MODES = ["cached", "system", "inline"]
+ACK = "Okay! I'm ready."
+MIN_CACHE_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "32768"))
+
+
+def estimate_tokens(text):
+    """
+    Cheap local token estimate (~4 characters per token for English), used
+    for budgeting without a count_tokens round trip.
+    """
+    return math.ceil(len(text) / 4)
+
+
+def _as_contents(contents):
+    if isinstance(contents, str):
+        return [{"role": "user", "parts": [contents]}]
+    if contents and not (isinstance(contents[0], dict) and "role" in contents[0]):
+        # A plain list of parts (text, inline audio, ...) is one user turn
+        return [{"role": "user", "parts": list(contents)}]
+    return list(contents)
+
+
+def _text_bytes(contents):
+    total = 0
+    for turn in contents:
+        for part in turn["parts"]:
+            if isinstance(part, str):
+                total += len(part.encode("utf-8"))
+            elif isinstance(part, dict):
+                total += len(part.get("data", b""))
+    return total
+
+
+def _rejected(error):
+    """
+    True for errors where the API turned the request down (bad argument,
+    unsupported feature, unknown cache), as opposed to network trouble.
+    """
+    if isinstance(error, (ValueError, TypeError)):
+        return True
+    return type(error).__name__ in ("InvalidArgument", "BadRequest", "NotFound", "FailedPrecondition")
+
+
+def _mode_error(mode, error):
+    """
+    True when a rejection is about the prefix mechanism itself: the cache for
+    "cached", the system instruction for "system". Anything else (a bad
+    request, safety blocks, quota) would fail the same way in every mode.
+    """
+    if not _rejected(error):
+        return False
+    message = str(error).lower()
+    if mode == "cached":
+        return type(error).__name__ == "NotFound" or "cache" in message
+    if mode == "system":
+        return "system_instruction" in message or "system instruction" in message or "developer instruction" in message
+    return False
+
+
+class PromptStats:
+    """
+    Per-call prompt size, as sent and as it would have been with the prefix
+    inlined, over a window of recent calls.
+    """
+
+    def __init__(self, window=1000):
+        self.calls = deque(maxlen=window)
+        self.modes = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, name, mode, prefix_bytes, dynamic_bytes, sent_bytes, usage=None):
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        cached_tokens = getattr(usage, "cached_content_token_count", None) or 0
+        if prompt_tokens is None:
+            # The cached prefix still counts toward the prompt, at the cached rate
+            prompt_tokens = math.ceil((sent_bytes + (prefix_bytes if mode in ("cached", "local") else 0)) / 4)
+            cached_tokens = math.ceil(prefix_bytes / 4) if mode in ("cached", "local") else 0
+        entry = {
+            "name": name,
+            "mode": mode,
+            "inline_bytes": prefix_bytes + dynamic_bytes,
+            "sent_bytes": sent_bytes,
+            "prompt_tokens": prompt_tokens,
+            "uncached_tokens": prompt_tokens - cached_tokens
+        }
+        with self.lock:
+            self.calls.append(entry)
+            self.modes[(name, mode)] += 1
+        return entry
+
+    def summary(self):
+        with self.lock:
+            calls = list(self.calls)
+            modes = dict(self.modes)
+        summary = {}
+        for name in sorted({call["name"] for call in calls}):
+            group = [call for call in calls if call["name"] == name]
+            inline = sum(call["inline_bytes"] for call in group) / len(group)
+            sent = sum(call["sent_bytes"] for call in group) / len(group)
+            summary[name] = {
+                "calls": len(group),
+                "modes": {mode: count for (n, mode), count in modes.items() if n == name},
+                "avg_inline_bytes": round(inline),
+                "avg_sent_bytes": round(sent),
+                "bytes_saved": f"{1 - sent / inline:.0%}" if inline else "0%",
+                "avg_prompt_tokens": round(sum(call["prompt_tokens"] for call in group) / len(group)),
+                "avg_uncached_tokens": round(sum(call["uncached_tokens"] for call in group) / len(group))
+            }
+        return summary
+
+
+class _LocalResponse:
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        yield self
+
+    async def _chunks(self):
+        yield self
+
+    def __aiter__(self):
+        return self._chunks()
+
+
+class _RecordedStream:
+    """
+    A streamed response that records its usage once fully read; Gemini only
+    reports usage on the final chunk.
+    """
+
+    def __init__(self, response, record):
+        self._response = response
+        self._record = record
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __iter__(self):
+        usage = None
+        for chunk in self._response:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            yield chunk
+        self._record(usage)
+
+    async def __aiter__(self):
+        usage = None
+        async for chunk in self._response:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            yield chunk
+        self._record(usage)
+
+
+class _Usage:
+    def __init__(self, prompt_token_count, cached_content_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.cached_content_token_count = cached_content_token_count
+
+
+class LocalStandInModel:
+    """
+    Offline stand-in for a Gemini model with the prefix cached: it answers
+    with `reply(contents)` and reports the prefix as cached tokens, so the
+    caching path can be exercised without an API key. A prefix below
+    `min_cache_tokens` is reported as sent in full, as the API would refuse
+    to cache it.
+    """
+
+    def __init__(self, prefix, reply=None, min_cache_tokens=0):
+        self.prefix_tokens = estimate_tokens(prefix)
+        self.cached = self.prefix_tokens >= min_cache_tokens
+        self.reply = reply or (lambda contents: "Meow! That's a great question. Let's explore it together!")
+
+    def generate_content(self, contents, **kwargs):
+        contents = _as_contents(contents)
+        dynamic_tokens = sum(estimate_tokens(p) for turn in contents for p in turn["parts"] if isinstance(p, str))
+        usage = _Usage(self.prefix_tokens + dynamic_tokens, self.prefix_tokens if self.cached else 0)
+        return _LocalResponse(self.reply(contents), usage)
+
+    async def generate_content_async(self, contents, **kwargs):
+        return self.generate_content(contents, **kwargs)
+
+
+class PrefixCachedModel:
+    """
+    A Gemini model with a static prompt prefix that callers leave out of
+    their requests. Has the same generate_content / generate_content_async
+    calls as genai.GenerativeModel.
+    """
+
+    def __init__(self, model_name, prefix, name="default", mode="auto", cache_model=None,
+                 ttl_minutes=60, min_cache_tokens=MIN_CACHE_TOKENS, stats=None, **model_options):
+        self.model_name = model_name
+        self.prefix = prefix
+        self.prefix_bytes = len(prefix.encode("utf-8"))
+        self.name = name
+        self.cache_model = cache_model
+        self.ttl = datetime.timedelta(minutes=ttl_minutes)
+        self.min_cache_tokens = min_cache_tokens
+        self.stats = stats or PromptStats()
+        self.model_options = model_options
+
+        self.modes = MODES if mode == "auto" else [mode]
+        self.mode = None
+        self.confirmed = False
+        self._model = None
+        self._cache = None
+        self.lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs):
+        contents = _as_contents(contents)
+        while True:
+            model, mode = self._current()
+            request = self._with_prefix(contents) if mode == "inline" else contents
+            try:
+                response = model.generate_content(request, **kwargs)
+            except Exception as e:
+                if self._recover(mode, e):
+                    continue
+                raise
+            return self._record(mode, contents, request, response, kwargs)
+
+    async def generate_content_async(self, contents, **kwargs):
+        contents = _as_contents(contents)
+        while True:
+            model, mode = self._current()
+            request = self._with_prefix(contents) if mode == "inline" else contents
+            try:
+                response = await model.generate_content_async(request, **kwargs)
+            except Exception as e:
+                if self._recover(mode, e):
+                    continue
+                raise
+            return self._record(mode, contents, request, response, kwargs)
+
+    def _current(self):
+        with self.lock:
+            while self._model is None:
+                if not self.modes:
+                    raise RuntimeError("No prompt prefix mode is available")
+                mode = self.modes[0]
+                try:
+                    self._model = self._build(mode)
+                    self.mode = mode
+                except Exception as e:
+                    print(f"Prompt cache ({self.name}): {mode} unavailable, {e}")
+                    self.modes = self.modes[1:]
+            return self._model, self.mode
+
+    def _build(self, mode):
+        if mode == "local":
+            return LocalStandInModel(self.prefix, min_cache_tokens=self.min_cache_tokens)
+        if genai is None:
+            raise RuntimeError("google-generativeai is not installed")
+        if mode == "cached":
+            if not self.cache_model:
+                raise RuntimeError("no versioned cache model configured")
+            if estimate_tokens(self.prefix) < self.min_cache_tokens:
+                raise RuntimeError(
+                    f"prefix is ~{estimate_tokens(self.prefix)} tokens, below the {self.min_cache_tokens}-token cache minimum"
+                )
+            from google.generativeai import caching
+            self._cache = caching.CachedContent.create(
+                model=self.cache_model, display_name=f"digimate-{self.name}",
+                system_instruction=self.prefix, ttl=self.ttl
+            )
+            return genai.GenerativeModel.from_cached_content(self._cache, **self.model_options)
+        if mode == "system":
+            return genai.GenerativeModel(self.model_name, system_instruction=self.prefix, **self.model_options)
+        if mode == "inline":
+            return genai.GenerativeModel(self.model_name, **self.model_options)
+        raise ValueError(f"Unknown prompt cache mode: {mode}")
+
+    def _recover(self, mode, error):
+        """
+        Decides whether a failed call is retried: an expired cache is
+        recreated once, and a mode that never worked (e.g. a model without
+        system instructions) is dropped for the next one. Errors that aren't
+        about the mode are raised to the caller.
+        """
+        with self.lock:
+            if not _mode_error(mode, error):
+                return False
+            if mode == "cached" and self.confirmed and self._cache is not None:
+                print(f"Prompt cache ({self.name}): recreating cached content, {error}")
+                self._model = self._cache = None
+                self.confirmed = False
+                return True
+            if not self.confirmed and len(self.modes) > 1 and self.modes[0] == mode:
+                print(f"Prompt cache ({self.name}): {mode} failed, {error}")
+                self.modes = self.modes[1:]
+                self._model = None
+                return True
+            return False
+
+    def _with_prefix(self, contents):
+        if contents and contents[0]["role"] == "user":
+            first = {"role": "user", "parts": [self.prefix] + list(contents[0]["parts"])}
+            return [first] + contents[1:]
+        return [{"role": "user", "parts": [self.prefix]}, {"role": "model", "parts": [ACK]}] + contents
+
+    def _record(self, mode, contents, request, response, kwargs):
+        """
+        Marks the mode as working and records the call's prompt size, once
+        the stream has been read for streamed responses. Returns the response
+        to hand back to the caller.
+        """
+        self.confirmed = True
+        prefix_sent = mode == "system" or (mode == "local" and not self._model.cached)
+        sent_bytes = _text_bytes(request) + (self.prefix_bytes if prefix_sent else 0)
+
+        def record(usage):
+            self.stats.record(self.name, mode, self.prefix_bytes, _text_bytes(contents), sent_bytes, usage)
+
+        if kwargs.get("stream"):
+            return _RecordedStream(response, record)
+        record(getattr(response, "usage_metadata", None))
+        return response
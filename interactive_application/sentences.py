@@ -0,0 +1,30 @@
+import re
+
+# Split on whitespace that follows sentence punctuation (optionally followed by
+# a closing quote or bracket), and on line breaks
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+|(?<=[.!?…]["\')\]])\s+|\n+')
+
+
+def split_sentences(text, min_chars=20):
+    """
+    Splits a response into sentence-sized chunks for incremental synthesis.
+    Fragments shorter than `min_chars` are merged into the next chunk so the
+    TTS engines are never asked to voice a lone "Wow!".
+    """
+    chunks = []
+    pending = ""
+    for part in _SENTENCE_END.split(text or ""):
+        part = part.strip()
+        if not part:
+            continue
+        pending = f"{pending} {part}".strip()
+        if len(pending) >= min_chars:
+            chunks.append(pending)
+            pending = ""
+
+    if pending:
+        if chunks:
+            chunks[-1] = f"{chunks[-1]} {pending}"
+        else:
+            chunks.append(pending)
+    return chunks
@@ -0,0 +1,112 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionCache:
+    """
+    Bounded LRU of active conversations in front of a ChatHistoryStore.
+
+    Turns are appended in memory and flushed to the store in batches by a
+    background writer every `flush_interval` seconds and at shutdown, so the
+    request path never waits on a disk write. Sessions idle for longer than
+    `idle_seconds`, or beyond `max_sessions`, are evicted; their unflushed
+    turns stay queued until the writer has persisted them.
+    """
+
+    def __init__(self, store, max_sessions=256, idle_seconds=1800, flush_interval=2.0, tail_size=20):
+        self.store = store
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.flush_interval = flush_interval
+        self.tail_size = tail_size
+        self._sessions = OrderedDict()  # user_name -> (last_used, messages)
+        self._pending = {}  # user_name -> [turn, ...] not yet on disk
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def get(self, user_name):
+        if not user_name:
+            return []
+        with self._lock:
+            if user_name in self._sessions:
+                self._sessions.move_to_end(user_name)
+                messages = self._sessions[user_name][1]
+                self._sessions[user_name] = (time.monotonic(), messages)
+                return list(messages)
+
+        # Cold session: read the tail once. Holding the flush lock keeps a
+        # concurrent batch from landing between the read and the merge below.
+        with self._flush_lock:
+            messages = self.store.tail(user_name, self.tail_size)
+            with self._lock:
+                if user_name in self._sessions:
+                    return list(self._sessions[user_name][1])
+                # Turns that were evicted before the writer got to them are
+                # not on disk yet
+                for turn in self._pending.get(user_name, []):
+                    messages.extend(turn)
+                messages = messages[-self.tail_size:]
+                self._remember(user_name, messages)
+                return list(messages)
+
+    def prefetch(self, user_name):
+        """
+        Warms the cache in the background, e.g. as soon as a child says their name.
+        """
+        if user_name:
+            threading.Thread(target=self.get, args=(user_name,), daemon=True).start()
+
+    def append(self, user_name, turn):
+        if not user_name:
+            return
+        with self._lock:
+            # A cold session picks the turn up from _pending on its next get()
+            if user_name in self._sessions:
+                messages = self._sessions.pop(user_name)[1]
+                self._remember(user_name, (messages + list(turn))[-self.tail_size:])
+            self._pending.setdefault(user_name, []).append(list(turn))
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for user_name, turns in pending.items():
+                try:
+                    self.store.append_many(user_name, turns)
+                except Exception as e:
+                    print(f"Chat history flush error for {user_name}: {e}")
+                    with self._lock:
+                        self._pending[user_name] = turns + self._pending.get(user_name, [])
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            while self._sessions:
+                user_name, (last_used, _) = next(iter(self._sessions.items()))
+                if last_used >= cutoff:
+                    break
+                del self._sessions[user_name]
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._writer.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def _remember(self, user_name, messages):
+        # Caller holds self._lock
+        self._sessions[user_name] = (time.monotonic(), messages)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            self.evict_idle()
@@ -0,0 +1,201 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from audio_utils import resample
+from vad import speech_segments
+
+try:
+    from faster_whisper import WhisperModel, decode_audio
+except ImportError:
+    WhisperModel = None
+
+try:
+    import whisper
+except ImportError:
+    whisper = None
+
+WHISPER_SAMPLE_RATE = 16000
+# Whisper's window; shorter clips can be decoded together as one batch
+WHISPER_WINDOW_SECONDS = 30
+
+
+def to_whisper_audio(sample_rate, samples):
+    """
+    Converts a (sample_rate, samples) pair as delivered by Gradio into mono
+    float32 at 16 kHz.
+    """
+    samples = np.asarray(samples)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    if np.issubdtype(samples.dtype, np.integer):
+        samples = samples.astype(np.float32) / np.iinfo(samples.dtype).max
+    else:
+        samples = samples.astype(np.float32, copy=False)
+    return resample(samples, sample_rate, WHISPER_SAMPLE_RATE).astype(np.float32, copy=False)
+
+
+class SpeechToText:
+    """
+    Whisper transcription with a selectable backend and model size.
+
+    backend="faster-whisper" runs CTranslate2 (compute_type="int8" gives
+    quantized CPU inference); backend="whisper" runs openai-whisper, and with
+    compute_type="int8" its Linear layers are dynamically quantized;
+    backend="remote" sends audio to the shared model server through `client`.
+    Every call reports its real-time factor (processing time / audio duration).
+    """
+
+    def __init__(self, model_size="base", backend="faster-whisper", device="cpu",
+                 compute_type="int8", cpu_threads=0, language="en", client=None):
+        if backend == "faster-whisper" and WhisperModel is None:
+            print("faster-whisper is not installed, falling back to openai-whisper")
+            backend = "whisper"
+
+        self.backend = backend
+        self.language = language
+        self.last_stats = None
+        self.client = client
+
+        if backend == "remote":
+            self.model = None
+        elif backend == "faster-whisper":
+            self.model = WhisperModel(
+                model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads
+            )
+        else:
+            self.model = whisper.load_model(model_size, device=device)
+            if compute_type == "int8" and device == "cpu":
+                import torch
+                self.model = torch.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+
+    def load_audio(self, audio_file):
+        if self.backend == "faster-whisper":
+            return decode_audio(audio_file, sampling_rate=WHISPER_SAMPLE_RATE)
+        return whisper.load_audio(audio_file)
+
+    def transcribe_file(self, audio_file):
+        if self.backend == "remote":
+            return self.client.transcribe(audio_file)
+        return self.transcribe(self.load_audio(audio_file))
+
+    def transcribe(self, samples):
+        start = time.perf_counter()
+        text = self._transcribe(samples)
+        self._record(len(samples) / WHISPER_SAMPLE_RATE, time.perf_counter() - start)
+        return text
+
+    def transcribe_batch(self, clips):
+        """
+        Transcribes several clips, in one forward pass where the backend
+        allows it: openai-whisper decodes clips of up to 30 s as a single
+        batch of mel spectrograms. faster-whisper and the remote backend have
+        no multi-clip call, so they, and longer clips, go one at a time.
+        """
+        start = time.perf_counter()
+        texts = [None] * len(clips)
+        short = [i for i, clip in enumerate(clips) if 0 < len(clip) <= WHISPER_SAMPLE_RATE * WHISPER_WINDOW_SECONDS]
+        if self.backend == "whisper" and len(short) > 1:
+            for i, text in zip(short, self._decode_batch([clips[i] for i in short])):
+                texts[i] = text
+        for i, clip in enumerate(clips):
+            if texts[i] is None:
+                texts[i] = self._transcribe(clip)
+        self._record(sum(len(clip) for clip in clips) / WHISPER_SAMPLE_RATE, time.perf_counter() - start)
+        return texts
+
+    def start_stream(self):
+        return StreamingTranscriber(self)
+
+    def _transcribe(self, samples):
+        if len(samples) == 0:
+            return ""
+        if self.backend == "remote":
+            return self.client.transcribe_samples(samples, WHISPER_SAMPLE_RATE)
+        if self.backend == "faster-whisper":
+            segments, _ = self.model.transcribe(samples, language=self.language, beam_size=1)
+            return "".join(segment.text for segment in segments).strip()
+        result = self.model.transcribe(samples, language=self.language, fp16=False)
+        return result["text"].strip()
+
+    def _decode_batch(self, clips):
+        import torch
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(
+                whisper.pad_or_trim(torch.from_numpy(np.asarray(clip, dtype=np.float32))),
+                n_mels=self.model.dims.n_mels
+            )
+            for clip in clips
+        ]).to(self.model.device)
+        options = whisper.DecodingOptions(language=self.language, fp16=False, without_timestamps=True)
+        return [result.text.strip() for result in whisper.decode(self.model, mels, options)]
+
+    def _record(self, audio_seconds, elapsed):
+        rtf = elapsed / audio_seconds if audio_seconds else 0.0
+        self.last_stats = {"audio_seconds": audio_seconds, "elapsed": elapsed, "rtf": rtf}
+        print(f"Transcribed {audio_seconds:.2f}s of audio in {elapsed:.2f}s (RTF {rtf:.2f}, {self.backend})")
+
+
+class StreamingTranscriber:
+    """
+    Transcribes a recording while it is still being made.
+
+    Audio chunks are buffered and split with the energy VAD; every segment
+    that is followed by enough silence is transcribed in the background, so
+    when recording stops only the last segment is left to do. One instance
+    covers one recording; start a new stream after finish().
+    """
+
+    def __init__(self, stt, min_silence_ms=400, max_segment_seconds=20):
+        self.stt = stt
+        self.min_silence = int(WHISPER_SAMPLE_RATE * min_silence_ms / 1000)
+        self.max_segment = int(WHISPER_SAMPLE_RATE * max_segment_seconds)
+        self.min_silence_ms = min_silence_ms
+        self.buffer = np.empty(0, dtype=np.float32)
+        self.committed = 0
+        self.pending = []
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stt-stream")
+        self.finished = False
+
+    def feed(self, sample_rate, samples):
+        if self.finished:
+            raise RuntimeError("This recording is finished; start a new stream")
+        self.buffer = np.concatenate((self.buffer, to_whisper_audio(sample_rate, samples)))
+        region = self.buffer[self.committed:]
+
+        for start, end in speech_segments(region, WHISPER_SAMPLE_RATE, min_silence_ms=self.min_silence_ms):
+            # The last segment may still be growing
+            if end > len(region) - self.min_silence:
+                break
+            self._submit(self.committed + start, self.committed + end)
+
+        # Whisper works on windows of at most 30 s, so never let a run-on
+        # utterance pile up
+        if len(self.buffer) - self.committed > self.max_segment:
+            self._submit(self.committed, len(self.buffer))
+
+    def finish(self):
+        self.finished = True
+        stopped = time.perf_counter()
+        if len(self.buffer) > self.committed:
+            self._submit(self.committed, len(self.buffer))
+        results = [future.result() for future in self.pending]
+        self.executor.shutdown(wait=False)
+
+        text = " ".join(t for t, _ in results if t).strip()
+        audio_seconds = len(self.buffer) / WHISPER_SAMPLE_RATE
+        self.stt._record(audio_seconds, sum(elapsed for _, elapsed in results))
+        print(f"Transcript ready {time.perf_counter() - stopped:.2f}s after recording stopped")
+        return text
+
+    def _transcribe_segment(self, segment):
+        start = time.perf_counter()
+        return self.stt._transcribe(segment), time.perf_counter() - start
+
+    def _submit(self, start, end):
+        segment = self.buffer[start:end]
+        self.pending.append(self.executor.submit(self._transcribe_segment, segment))
+        self.committed = end
@@ -0,0 +1,285 @@
+"""
+Lightweight span tracing for Buddy's voice turns.
+
+Each turn is a root span; every stage inside it (transcription, history,
+Gemini, synthesis and the TTS tier that produced the audio) is a child span.
+Finished spans are appended as JSON lines to a rotating log:
+
+    {"trace": "9f2c...", "span": "41ab...", "parent": "9f2c...", "name": "tts.bark",
+     "start": 1718000000.12, "ms": 5321.4, "status": "error", "error": "...", "attrs": {...}}
+
+Summarize a log (including its rotated backups) with:
+
+    python tracing.py report                      # traces.jsonl
+    python tracing.py report --path kiosk3.jsonl --since 24 --user 3fa9c1d2e0
+"""
+import argparse
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import time
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+
+_current = contextvars.ContextVar("buddy_trace_span", default=None)
+
+
+def user_key(user_name):
+    """
+    Stable pseudonymous id for a child, so traces can be grouped per child
+    without writing names to the log.
+    """
+    if not user_name:
+        return None
+    return hashlib.sha1(user_name.strip().lower().encode("utf-8")).hexdigest()[:10]
+
+
+class Span:
+    def __init__(self, tracer, name, parent=None, attrs=None):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = dict(attrs or {})
+        self.status = "ok"
+        self.error = None
+        self.start = None
+        self._t0 = None
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def fail(self, error):
+        self.status = "error"
+        self.error = str(error)[:300]
+
+    def begin(self):
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def elapsed_ms(self):
+        return None if self._t0 is None else (time.perf_counter() - self._t0) * 1000
+
+    def end(self):
+        if self._t0 is None:
+            return
+        elapsed_ms = (time.perf_counter() - self._t0) * 1000
+        self._t0 = None
+        self.tracer.record(self, elapsed_ms)
+
+    def __enter__(self):
+        self.begin()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.fail(exc)
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Exited in a different context (e.g. a generator resumed on
+            # another thread); just restore the parent
+            _current.set(self.parent)
+        self.end()
+        return False
+
+
+class Tracer:
+    """
+    Creates spans and writes them to a size-rotated JSONL file.
+
+    The current span travels in a context variable, so stages called from a
+    traced block attach to it automatically. Work handed to a thread pool
+    keeps its parent when submitted through `submit()`.
+    """
+
+    def __init__(self, path="traces.jsonl", max_bytes=5_000_000, backups=3, enabled=True):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.logger = logging.getLogger(f"buddy.trace.{self.path}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if enabled and not self.logger.handlers:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+
+    def span(self, name, parent=None, **attrs):
+        """
+        A child of `parent` (default: the current span), or a new trace.
+        Use as a context manager, or call begin()/end() when the span has
+        to outlive one block, as in a streaming generator.
+        """
+        return Span(self, name, parent or _current.get(), attrs)
+
+    def current(self):
+        return _current.get()
+
+    @contextlib.contextmanager
+    def activate(self, span):
+        """
+        Makes `span` the current span for a block without timing anything,
+        e.g. inside one step of a generator that owns the span.
+        """
+        token = _current.set(span)
+        try:
+            yield span
+        finally:
+            _current.reset(token)
+
+    def annotate(self, **attrs):
+        span = _current.get()
+        if span is not None:
+            span.set(**attrs)
+
+    def submit(self, pool, fn, *args, parent=None):
+        """
+        pool.submit() that runs `fn` with `parent` (default: the current span)
+        as its current span.
+        """
+        ctx = contextvars.copy_context()
+        ctx.run(_current.set, parent or _current.get())
+        return pool.submit(ctx.run, fn, *args)
+
+    def record(self, span, elapsed_ms):
+        if not self.enabled:
+            return
+        entry = {
+            "trace": span.trace_id,
+            "span": span.span_id,
+            "parent": span.parent_id,
+            "name": span.name,
+            "start": round(span.start, 3),
+            "ms": round(elapsed_ms, 1),
+            "status": span.status
+        }
+        if span.error:
+            entry["error"] = span.error
+        if span.attrs:
+            entry["attrs"] = span.attrs
+        try:
+            self.logger.info(json.dumps(entry, default=str))
+        except Exception as e:
+            print(f"Trace write error: {e}")
+
+
+def read_spans(path, since_hours=None):
+    """
+    Reads a trace log and its rotated backups, oldest first.
+    """
+    path = Path(path)
+    files = sorted(path.parent.glob(path.name + ".*"), key=lambda p: -int(p.suffix[1:]) if p.suffix[1:].isdigit() else 0)
+    files.append(path)
+    cutoff = time.time() - since_hours * 3600 if since_hours else None
+
+    spans = []
+    for file in files:
+        if not file.exists():
+            continue
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if cutoff is None or span["start"] >= cutoff:
+                    spans.append(span)
+    return spans
+
+
+def summarize(spans, user=None):
+    """
+    Per-stage latency percentiles, TTS tier usage, and how often each stage
+    was the slowest part of its turn.
+    """
+    if user:
+        traces = {s["trace"] for s in spans if s.get("attrs", {}).get("user") == user}
+        spans = [s for s in spans if s["trace"] in traces]
+
+    by_name = defaultdict(list)
+    errors = Counter()
+    tiers = Counter()
+    children = defaultdict(list)
+    for span in spans:
+        by_name[span["name"]].append(span["ms"])
+        if span["status"] != "ok":
+            errors[span["name"]] += 1
+        # The tier lands on whichever span picked it ("synthesize" for the
+        # model tiers, "generate_voice" for the pyttsx3 fallback)
+        tier = span.get("attrs", {}).get("tier")
+        if tier:
+            tiers[tier] += 1
+        if span["parent"] is not None and span["parent"] == span["trace"]:
+            children[span["trace"]].append(span)
+
+    stages = {}
+    for name, durations in sorted(by_name.items()):
+        values = np.array(durations)
+        stages[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "p50_ms": round(float(np.percentile(values, 50)), 1),
+            "p90_ms": round(float(np.percentile(values, 90)), 1),
+            "p99_ms": round(float(np.percentile(values, 99)), 1),
+            "max_ms": round(float(values.max()), 1)
+        }
+
+    bottlenecks = Counter(max(stage_spans, key=lambda s: s["ms"])["name"] for stage_spans in children.values())
+    return {"stages": stages, "tts_tiers": dict(tiers), "bottlenecks": dict(bottlenecks.most_common())}
+
+
+def print_report(summary):
+    print(f"{'stage':<22}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stage in summary["stages"].items():
+        print(
+            f"{name:<22}{stage['count']:>7}{stage['errors']:>8}{stage['p50_ms']:>10}"
+            f"{stage['p90_ms']:>10}{stage['p99_ms']:>10}{stage['max_ms']:>10}"
+        )
+    if summary["tts_tiers"]:
+        total = sum(summary["tts_tiers"].values())
+        print("\nTTS tier that produced the audio:")
+        for tier, count in sorted(summary["tts_tiers"].items(), key=lambda item: -item[1]):
+            print(f"  {tier:<20}{count:>7}  ({count / total:.0%})")
+    if summary["bottlenecks"]:
+        print("\nSlowest stage per turn:")
+        for name, count in summary["bottlenecks"].items():
+            print(f"  {name:<20}{count:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize Buddy trace logs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser("report", help="per-stage latency percentiles")
+    report.add_argument("--path", default=os.getenv("BUDDY_TRACE_FILE", "traces.jsonl"))
+    report.add_argument("--since", type=float, help="only the last N hours")
+    report.add_argument("--user", help="only turns of this user key")
+    report.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = summarize(read_spans(args.path, args.since), args.user)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    elif not summary["stages"]:
+        print(f"No spans in {args.path}")
+    else:
+        print_report(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Repeatable benchmark for the TTS engines behind EmotionalSpeech.
+
+    python tts_benchmark.py                          # every engine, 3 runs each
+    python tts_benchmark.py --engines glow pyttsx3 --runs 5
+    python tts_benchmark.py --output results/tts_bench
+
+Every engine runs in its own subprocess, so model loading and peak RSS are
+measured in isolation and one engine's memory can't hide another's. Each text
+of the corpus is synthesized sentence by sentence, the way streaming replies
+are, and for every run the benchmark records:
+
+    ttfb_seconds    time until the first sentence's audio is ready (for the
+                    network stand-in: until its first byte arrives)
+    total_seconds   time until all audio is ready
+    audio_seconds   duration of the produced audio
+    rtf             total_seconds / audio_seconds (below 1 is faster than real time)
+    output_bytes    size of the audio as written (16-bit WAV, or MP3 for the stand-in)
+    peak_rss_mb     peak resident memory of the engine's process
+
+Engines are "bark:<emotion>" for every EmotionalSpeech voice preset, "glow",
+"pyttsx3" and "network". The network engines (gTTS, ElevenLabs) can't be
+timed repeatably, so "network" is a local HTTP server that adds a fixed
+latency and streams at a capped bitrate. Its output is not real speech: the
+audio length is estimated from the text at TTS_BENCH_NETWORK_CHARS_PER_SECOND
+and the response is that many seconds of MP3 at TTS_BENCH_NETWORK_AUDIO_KBPS,
+cut from the samples in ../TTS/Results. Its rows are marked "simulated".
+Results are written as JSON and CSV.
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from sentences import split_sentences
+
+# Same voice presets as EmotionalSpeech.emotions in buddy.py
+BARK_PRESETS = {
+    "happy": "v2/en_speaker_6",
+    "sad": "v2/en_speaker_3",
+    "excited": "v2/en_speaker_9",
+    "calm": "v2/en_speaker_2",
+    "singing": "v2/en_speaker_7",
+    "storytelling": "v2/en_speaker_4"
+}
+
+ENGINES = [f"bark:{emotion}" for emotion in BARK_PRESETS] + ["glow", "pyttsx3", "network"]
+
+CORPUS = {
+    "short": "Hi Sam! How was your day?",
+    "medium": (
+        "Wow, a butterfly garden sounds amazing! Butterflies taste with their feet, "
+        "did you know that? What colour was your favourite one?"
+    ),
+    "story": (
+        "Once upon a time, in a sunny meadow, there lived a tiny bumblebee named Bella. "
+        "Bella was smaller than all the other bees, and she worried that she could never "
+        "carry as much pollen as her friends. One morning a big storm rolled over the hills. "
+        "The other bees were too heavy to fly through the narrow gap in the old oak tree, "
+        "but Bella zipped right through and found a dry, safe place for the whole hive. "
+        "From that day on, everyone knew that being small can be a superpower. The end!"
+    )
+}
+
+RESULTS_DIR = Path(__file__).resolve().parent.parent / "TTS" / "Results"
+NETWORK_LATENCY_MS = float(os.getenv("TTS_BENCH_NETWORK_LATENCY_MS", "250"))
+NETWORK_KBPS = float(os.getenv("TTS_BENCH_NETWORK_KBPS", "256"))
+NETWORK_CHARS_PER_SECOND = float(os.getenv("TTS_BENCH_NETWORK_CHARS_PER_SECOND", "14"))
+NETWORK_AUDIO_KBPS = float(os.getenv("TTS_BENCH_NETWORK_AUDIO_KBPS", "64"))
+
+FIELDS = [
+    "engine", "simulated", "text", "run", "sentences", "load_seconds", "ttfb_seconds", "total_seconds",
+    "audio_seconds", "rtf", "output_bytes", "peak_rss_mb"
+]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def wav_bytes(path, audio, sample_rate):
+    sf.write(path, np.asarray(audio, dtype=np.float32), sample_rate, subtype="PCM_16")
+    return os.path.getsize(path), len(audio) / sample_rate
+
+
+class BarkEngine:
+    suffix = ".wav"
+
+    def __init__(self, emotion):
+        from bark import SAMPLE_RATE, generate_audio, preload_models
+        preload_models()
+        self.generate_audio = generate_audio
+        self.sample_rate = SAMPLE_RATE
+        self.voice_preset = BARK_PRESETS[emotion]
+
+    def synthesize(self, text, path):
+        audio = self.generate_audio(text, history_prompt=self.voice_preset)
+        return wav_bytes(path, audio, self.sample_rate)
+
+
+class GlowEngine:
+    suffix = ".wav"
+
+    def __init__(self):
+        import torch
+        from TTS.api import TTS
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.tts = TTS("tts_models/en/ljspeech/glow-tts").to(device)
+
+    def synthesize(self, text, path):
+        audio = self.tts.tts(text=text)
+        return wav_bytes(path, audio, self.tts.synthesizer.output_sample_rate)
+
+
+class Pyttsx3Engine:
+    suffix = ".wav"
+
+    def __init__(self):
+        import pyttsx3
+        self.engine = pyttsx3.init()
+
+    def synthesize(self, text, path):
+        self.engine.save_to_file(text, path)
+        self.engine.runAndWait()
+        return os.path.getsize(path), sf.info(path).duration
+
+
+class NetworkStandIn:
+    """
+    Stands in for a network engine: a local server that waits a fixed latency
+    before the first byte and streams at a capped bitrate. The response size
+    and audio duration are derived from the text, so longer texts cost more,
+    but the audio itself is simulated.
+    """
+
+    suffix = ".mp3"
+    simulated = True
+
+    def __init__(self, latency_ms=NETWORK_LATENCY_MS, kbps=NETWORK_KBPS):
+        samples = sorted(RESULTS_DIR.glob("*.mp3"))
+        if not samples:
+            raise RuntimeError(f"No sample files in {RESULTS_DIR}")
+        self.payload = b"".join(sample.read_bytes() for sample in samples)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler(latency_ms / 1000, kbps * 1000 / 8))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.first_byte = None
+
+    def _handler(self, latency, bytes_per_second):
+        payload = self.payload
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                size = int(self.path.strip("/"))
+                audio = (payload * (size // len(payload) + 1))[:size]
+                time.sleep(latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/mpeg")
+                self.send_header("Content-Length", str(len(audio)))
+                self.end_headers()
+                chunk = 4096
+                for start in range(0, len(audio), chunk):
+                    self.wfile.write(audio[start:start + chunk])
+                    time.sleep(min(chunk, len(audio) - start) / bytes_per_second)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def synthesize(self, text, path):
+        duration = len(text) / NETWORK_CHARS_PER_SECOND
+        size = max(1, int(duration * NETWORK_AUDIO_KBPS * 1000 / 8))
+        with urllib.request.urlopen(f"{self.url}/{size}") as response, open(path, "wb") as f:
+            f.write(response.read(1))
+            self.first_byte = time.perf_counter()
+            f.write(response.read())
+        return os.path.getsize(path), duration
+
+
+def make_engine(name):
+    if name.startswith("bark:"):
+        return BarkEngine(name.split(":", 1)[1])
+    if name == "glow":
+        return GlowEngine()
+    if name == "pyttsx3":
+        return Pyttsx3Engine()
+    if name == "network":
+        return NetworkStandIn()
+    raise ValueError(f"Unknown engine: {name}")
+
+
+def run_engine(name, runs):
+    """
+    Benchmarks one engine in this process and prints one JSON row per run.
+    """
+    start = time.perf_counter()
+    engine = make_engine(name)
+    load_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        # Untimed warm-up, so the first run doesn't pay for lazy initialization
+        engine.synthesize(CORPUS["short"], os.path.join(output_dir, "warmup" + engine.suffix))
+
+        for label, text in CORPUS.items():
+            sentences = split_sentences(text)
+            for run in range(runs):
+                ttfb = None
+                output_bytes = 0
+                audio_seconds = 0.0
+                start = time.perf_counter()
+                for i, sentence in enumerate(sentences):
+                    size, duration = engine.synthesize(sentence, os.path.join(output_dir, f"{label}-{run}-{i}{engine.suffix}"))
+                    if ttfb is None:
+                        ttfb = (getattr(engine, "first_byte", None) or time.perf_counter()) - start
+                    output_bytes += size
+                    audio_seconds = None if duration is None or audio_seconds is None else audio_seconds + duration
+                total = time.perf_counter() - start
+
+                row = {
+                    "engine": name,
+                    "simulated": getattr(engine, "simulated", False),
+                    "text": label,
+                    "run": run,
+                    "sentences": len(sentences),
+                    "load_seconds": round(load_seconds, 3),
+                    "ttfb_seconds": round(ttfb, 4),
+                    "total_seconds": round(total, 4),
+                    "audio_seconds": None if audio_seconds is None else round(audio_seconds, 3),
+                    "rtf": round(total / audio_seconds, 4) if audio_seconds else None,
+                    "output_bytes": output_bytes,
+                    "peak_rss_mb": round(peak_rss_mb(), 1)
+                }
+                print(json.dumps(row), flush=True)
+
+
+def run_all(engines, runs):
+    rows = []
+    for name in engines:
+        print(f"Benchmarking {name}...", file=sys.stderr)
+        result = subprocess.run(
+            [sys.executable, __file__, "--worker", name, "--runs", str(runs)],
+            capture_output=True, text=True
+        )
+        engine_rows = [json.loads(line) for line in result.stdout.splitlines() if line.startswith("{")]
+        if result.returncode != 0:
+            print(f"{name} failed: {result.stderr.strip().splitlines()[-1:] or result.returncode}", file=sys.stderr)
+        rows.extend(engine_rows)
+    return rows
+
+
+def summarize(rows):
+    """
+    Median of each metric per engine and text length.
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["engine"], row["text"]), []).append(row)
+
+    summary = []
+    for (engine, text), group in groups.items():
+        entry = {"engine": engine, "simulated": group[0].get("simulated", False), "text": text, "runs": len(group)}
+        for field in ["ttfb_seconds", "total_seconds", "audio_seconds", "rtf", "output_bytes", "peak_rss_mb"]:
+            values = [row[field] for row in group if row[field] is not None]
+            entry[field] = round(float(np.median(values)), 4) if values else None
+        summary.append(entry)
+    return summary
+
+
+def write_results(rows, output):
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output.with_suffix(".json"), "w") as f:
+        json.dump({"corpus": CORPUS, "runs": rows, "summary": summarize(rows)}, f, indent=2)
+    with open(output.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Wrote {output.with_suffix('.json')} and {output.with_suffix('.csv')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TTS engines used by Buddy")
+    parser.add_argument("--engines", nargs="+", default=ENGINES, help=f"any of: {' '.join(ENGINES)}")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", default="tts_benchmark_results")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_engine(args.worker, args.runs)
+        return
+
+    rows = run_all(args.engines, args.runs)
+    for entry in summarize(rows):
+        print(
+            f"{entry['engine']:<20} {entry['text']:<7} ttfb {entry['ttfb_seconds']}s  "
+            f"rtf {entry['rtf']}  {entry['output_bytes']} bytes  {entry['peak_rss_mb']} MB"
+            + ("  (simulated)" if entry["simulated"] else "")
+        )
+    write_results(rows, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import numpy as np
+
+
+def frame_energy_db(samples, frame_len):
+    """
+    Returns the RMS energy of each non-overlapping frame in dBFS.
+    `samples` is a float array in [-1, 1]; a trailing partial frame is dropped.
+    """
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-6))
+
+
+def speech_segments(samples, sample_rate, frame_ms=30, margin_db=12, min_silence_ms=300,
+                    min_speech_ms=150, pad_ms=150):
+    """
+    Splits audio into speech segments by frame energy.
+
+    The noise floor is estimated as the 10th percentile of frame energies and a
+    frame counts as speech when it is `margin_db` louder. Gaps shorter than
+    `min_silence_ms` are bridged, blips shorter than `min_speech_ms` dropped,
+    and each segment is padded by `pad_ms` on both sides.
+    Returns a list of (start, end) sample indices.
+    """
+    frame_len = max(1, int(sample_rate * frame_ms / 1000))
+    energy = frame_energy_db(samples, frame_len)
+    if energy.size == 0:
+        return []
+
+    threshold = np.percentile(energy, 10) + margin_db
+    voiced = energy > threshold
+
+    # Rising/falling edges of the voiced mask give the raw segments
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_gap = int(np.ceil(min_silence_ms / frame_ms))
+    min_len = int(np.ceil(min_speech_ms / frame_ms))
+    pad = int(sample_rate * pad_ms / 1000)
+
+    segments = []
+    for start, end in zip(starts, ends):
+        if segments and start - segments[-1][1] < min_gap:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+
+    return [
+        (max(0, start * frame_len - pad), min(len(samples), end * frame_len + pad))
+        for start, end in segments
+        if end - start >= min_len
+    ]
+
+
+def zero_crossing_rate(frames):
+    """
+    Returns the fraction of sign changes in each row of a 2-D frame array.
+    """
+    signs = np.signbit(frames)
+    return np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1)
+
+
+class Endpointer:
+    """
+    Streaming end-of-utterance detection over raw 16-bit mono PCM.
+
+    Energy and zero-crossing rate are computed for a whole block of frames at
+    once. A frame is voiced when it is `margin_db` above the noise floor and its
+    zero-crossing rate looks like speech (very loud frames count regardless).
+    The noise floor follows the room: it drops immediately to quieter frames
+    and rises slowly otherwise, so it keeps up as classroom noise changes. A
+    phrase starts after `min_speech_ms` of voiced audio and ends after
+    `hangover_ms` of silence; `preroll_ms` of audio before the start is kept
+    so the first syllable isn't clipped.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=20, margin_db=10, hangover_ms=300,
+                 min_speech_ms=100, preroll_ms=200, max_phrase_seconds=10,
+                 noise_adapt=0.05, zcr_range=(0.02, 0.5), loud_db=25):
+        self.sample_rate = sample_rate
+        self.frame_len = int(sample_rate * frame_ms / 1000)
+        self.frame_bytes = self.frame_len * 2
+        self.margin_db = margin_db
+        self.hangover_frames = max(1, int(hangover_ms / frame_ms))
+        self.min_speech_frames = max(1, int(min_speech_ms / frame_ms))
+        self.preroll_frames = int(preroll_ms / frame_ms)
+        self.max_phrase_frames = int(max_phrase_seconds * 1000 / frame_ms)
+        self.noise_adapt = noise_adapt
+        self.zcr_range = zcr_range
+        self.loud_db = loud_db
+
+        self.noise_floor = None
+        self._remainder = b""
+        self._preroll = []
+        self._phrase = []
+        self._voiced_run = 0
+        self._silent_run = 0
+        self.in_speech = False
+
+    def process(self, pcm):
+        """
+        Feeds a block of PCM bytes and returns the phrases (as PCM bytes) that
+        ended inside it.
+        """
+        data = self._remainder + pcm
+        n_frames = len(data) // self.frame_bytes
+        self._remainder = data[n_frames * self.frame_bytes:]
+        if n_frames == 0:
+            return []
+
+        raw = data[:n_frames * self.frame_bytes]
+        frames = np.frombuffer(raw, dtype=np.int16).reshape(n_frames, self.frame_len)
+        samples = frames.astype(np.float32) / 32768.0
+        energy = 20 * np.log10(np.maximum(np.sqrt(np.mean(np.square(samples), axis=1)), 1e-6))
+        zcr = zero_crossing_rate(samples)
+
+        if self.noise_floor is None:
+            self.noise_floor = float(np.min(energy))
+
+        phrases = []
+        for i in range(n_frames):
+            frame = raw[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            above = energy[i] - self.noise_floor
+            voiced = above > self.loud_db or (
+                above > self.margin_db and self.zcr_range[0] <= zcr[i] <= self.zcr_range[1]
+            )
+
+            # Track the room: quieter frames lower the floor at once, louder
+            # background noise raises it gradually. Voiced frames still nudge
+            # it a little so a lasting jump in noise isn't heard as endless speech.
+            if energy[i] < self.noise_floor:
+                self.noise_floor = float(energy[i])
+            else:
+                rate = self.noise_adapt if not voiced else self.noise_adapt / 20
+                self.noise_floor += rate * (float(energy[i]) - self.noise_floor)
+
+            phrase = self._step(frame, voiced)
+            if phrase:
+                phrases.append(phrase)
+        return phrases
+
+    def flush(self):
+        """
+        Returns whatever phrase is in progress, e.g. when listening stops.
+        """
+        phrase = b"".join(self._phrase) if self.in_speech else None
+        self._reset()
+        return phrase
+
+    def _step(self, frame, voiced):
+        if not self.in_speech:
+            self._preroll.append(frame)
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.min_speech_frames:
+                self.in_speech = True
+                self._phrase = list(self._preroll)
+                self._silent_run = 0
+            self._preroll = self._preroll[-(self.preroll_frames + self.min_speech_frames):]
+            return None
+
+        self._phrase.append(frame)
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run >= self.hangover_frames or len(self._phrase) >= self.max_phrase_frames:
+            phrase = b"".join(self._phrase)
+            self._reset()
+            return phrase
+        return None
+
+    def _reset(self):
+        self.in_speech = False
+        self._phrase = []
+        self._preroll = []
+        self._voiced_run = 0
+        self._silent_run = 0